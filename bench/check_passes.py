@@ -0,0 +1,111 @@
+import contextlib
+import glob
+import io
+import os
+import sys
+import tempfile
+from optparse import OptionParser
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TOP = os.path.dirname(HERE)
+sys.path.insert(0, TOP)
+
+import c2ir
+import ir_sim
+
+# compiles C sources without options and with each pass, runs every board
+# of the results in ir_sim on the same random arguments and reports the
+# runs whose value or globals differ from those of the build without options
+
+CONFIGS = [
+    "--fold",
+    "--cse",
+    "--fold --cse",
+    "--balance",
+    "--select",
+    "--if-convert",
+    "--narrow",
+    "--unroll 4",
+    "--unroll -1",
+    "--inline 8",
+    "--no-wait-calls",
+    "--pipeline",
+    "--cleanup",
+    "--schedule",
+    "--regalloc",
+    "--cleanup --schedule --chain-budget 4 --regalloc",
+    "--fold --cse --balance --select --if-convert --narrow --inline 8 --no-wait-calls --cleanup --schedule --chain-budget 4 --regalloc",
+]
+
+def compile_source(path, options, workdir):
+    dest = os.path.join(workdir, "check.ir")
+    opts, _ = c2ir.make_option_parser().parse_args(options + ["-o", dest])
+    with contextlib.redirect_stdout(io.StringIO()):
+        c2ir.build([path], opts)
+    return ir_sim.read_module(dest)
+
+def run(module, name, args, max_cycles):
+    # the value of the call and the globals it left, or the error it raised
+    sim = ir_sim.Simulator(module.boards, module.variables, max_cycles)
+    try:
+        value, cycles = sim.call(name, args)
+    except ir_sim.SimulationError as e:
+        return "error: {}".format(e)
+    return value, sim.members
+
+def options_of(config, module):
+    # --pipeline alone pipelines every board
+    options = config.split()
+    if options == ["--pipeline"]:
+        options = []
+        for board in module.boards:
+            options += ["--pipeline", board.name]
+    return options
+
+def check(path, opts, workdir):
+    base = compile_source(path, [], workdir)
+    vectors = {}
+    expected = {}
+    for board in base.boards:
+        vectors[board.name] = ir_sim.random_vectors(board, opts.runs, opts.low, opts.high, opts.seed)
+        expected[board.name] = [run(base, board.name, args, opts.max_cycles) for args in vectors[board.name]]
+    failures = 0
+    for config in opts.configs:
+        module = compile_source(path, options_of(config, base), workdir)
+        bad = 0
+        for board in base.boards:
+            for args, r in zip(vectors[board.name], expected[board.name]):
+                if isinstance(r, str):
+                    continue # the build without options does not finish either
+                got = run(module, board.name, args, opts.max_cycles)
+                if got != r:
+                    bad += 1
+                    if bad <= opts.show:
+                        print("  {}({}): {} instead of {}".format(board.name, ", ".join([str(x) for x in args]), got, r))
+        print("{:24} {:60} {}".format(os.path.basename(path), config, "ok" if bad == 0 else "{} runs differ".format(bad)))
+        failures += bad
+    return failures
+
+if __name__ == '__main__':
+    usage = "Usage: %prog [options] [C-sources]"
+    p = OptionParser(usage)
+    p.add_option("-c", "--c2ir-options", dest="configs", action="append", help="c2ir.py options to check instead of the default sets, may be repeated")
+    p.add_option("-n", "--runs", dest="runs", type="int", default=50, help="random argument vectors per board")
+    p.add_option("--range", dest="range", default="-20,100", metavar="LOW,HIGH", help="range of the random arguments")
+    p.add_option("--seed", dest="seed", type="int", default=1, help="seed of the random arguments")
+    p.add_option("--max-cycles", dest="max_cycles", type="int", default=10**5, help="cycles a call may take before it is stopped")
+    p.add_option("--show", dest="show", type="int", default=3, help="differing runs printed per board and option set")
+    opts, args = p.parse_args()
+
+    if opts.configs is None:
+        opts.configs = CONFIGS
+    opts.low, opts.high = [int(v) for v in opts.range.split(",")]
+    if len(args) == 0:
+        args = sorted(glob.glob(os.path.join(TOP, "examples", "*.c")))
+
+    failures = 0
+    with tempfile.TemporaryDirectory() as workdir:
+        for path in args:
+            failures += check(path, opts, workdir)
+    if failures > 0:
+        exit(1)
@@ -0,0 +1,120 @@
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from optparse import OptionParser
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TOP = os.path.dirname(HERE)
+sys.path.insert(0, TOP)
+
+import c2ir
+import ir_ast
+import ir_emit
+import workloads
+
+# compiles the synthetic workloads and records time, memory and IR size.
+# Results are written as JSON; --compare prints the ratios against an
+# earlier result file.
+
+def revision():
+    try:
+        out = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=TOP, stderr=subprocess.DEVNULL)
+        return out.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compile_source(path, opts):
+    module = ir_ast.Module("bench")
+    c2ir.parse(path, module)
+    c2ir.optimize(module, opts)
+    out = io.StringIO()
+    ir_emit.write_module(out, module.name, module.variables, module.boards)
+    return module, out.getvalue()
+
+def run(name, size, opts, repeat, workdir):
+    path = os.path.join(workdir, "{}_{}.c".format(name, size))
+    f = open(path, "w")
+    f.write(workloads.WORKLOADS[name](size))
+    f.close()
+
+    times = []
+    for i in range(repeat):
+        t = time.perf_counter()
+        module, text = compile_source(path, opts)
+        times.append(time.perf_counter() - t)
+
+    tracemalloc.start()
+    compile_source(path, opts)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    boards = []
+    for board in module.boards:
+        slots = len(board.slots)
+        items = sum([len(s.items) for s in board.slots])
+        constants = len([v for v in board.variables if isinstance(v, ir_ast.Constant)])
+        boards.append({"name": board.name, "slots": slots, "items": items,
+                       "variables": len(board.variables) - constants, "constants": constants})
+    return {"workload": name, "size": size,
+            "time": min(times), "peak_memory": peak, "ir_bytes": len(text.encode()),
+            "boards": boards}
+
+def compare(results, base):
+    old = {}
+    for r in base["results"]:
+        old[(r["workload"], r["size"])] = r
+    print("{:16} {:>6} {:>10} {:>10} {:>10}".format("workload", "size", "time", "memory", "ir size"))
+    for r in results:
+        o = old.get((r["workload"], r["size"]))
+        if o is None:
+            continue
+        print("{:16} {:>6} {:>9.2f}x {:>9.2f}x {:>9.2f}x".format(r["workload"], r["size"],
+              r["time"] / max(o["time"], 1e-9), r["peak_memory"] / max(o["peak_memory"], 1),
+              r["ir_bytes"] / max(o["ir_bytes"], 1)))
+
+if __name__ == '__main__':
+    usage = "Usage: %prog [options]"
+    p = OptionParser(usage)
+    p.add_option("-w", "--workload", dest="workloads", action="append", help="workload to run (default: all), may be repeated")
+    p.add_option("-s", "--sizes", dest="sizes", help="comma separated sizes (default: per workload)")
+    p.add_option("-r", "--repeat", dest="repeat", type="int", default=3, help="timed compilations per case, the fastest is kept")
+    p.add_option("-c", "--c2ir-options", dest="c2ir_options", default="", help="c2ir.py options to compile with, e.g. \"--cleanup --schedule\"")
+    p.add_option("-o", "--output", dest="output", default="bench.json", help="JSON file to write")
+    p.add_option("--compare", dest="compare", help="earlier JSON result to compare with")
+    opts, args = p.parse_args()
+
+    names = opts.workloads
+    if names is None:
+        names = sorted(workloads.WORKLOADS.keys())
+    c2ir_opts, _ = c2ir.make_option_parser().parse_args(opts.c2ir_options.split())
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in names:
+            if opts.sizes is not None:
+                sizes = [int(s) for s in opts.sizes.split(",")]
+            else:
+                sizes = workloads.DEFAULT_SIZES[name]
+            for size in sizes:
+                r = run(name, size, c2ir_opts, opts.repeat, workdir)
+                slots = sum([b["slots"] for b in r["boards"]])
+                print("{:16} {:>6} {:8.4f} s {:10d} B peak {:10d} B IR {:8d} slots".format(name, size, r["time"], r["peak_memory"], r["ir_bytes"], slots))
+                results.append(r)
+
+    report = {"revision": revision(), "python": platform.python_version(),
+              "c2ir_options": opts.c2ir_options, "results": results}
+    f = open(opts.output, "w")
+    json.dump(report, f, indent=1)
+    f.close()
+
+    if opts.compare is not None:
+        f = open(opts.compare)
+        base = json.load(f)
+        f.close()
+        compare(results, base)
@@ -0,0 +1,52 @@
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+# measures the start-up cost of c2ir.py and checks it against a budget
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TOP = os.path.dirname(HERE)
+
+SOURCE = "int add(int a, int b){ return a + b; }\n"
+
+def measure_import():
+    code = "import time; t = time.perf_counter(); import c2ir; print(time.perf_counter() - t)"
+    out = subprocess.check_output([sys.executable, "-c", code], cwd=TOP)
+    return float(out)
+
+def measure_parser():
+    code = "import time, c2ir; t = time.perf_counter(); c2ir.get_parser(); print(time.perf_counter() - t)"
+    out = subprocess.check_output([sys.executable, "-c", code], cwd=TOP)
+    return float(out)
+
+def measure_run(workdir):
+    src = os.path.join(workdir, "startup.c")
+    f = open(src, "w")
+    f.write(SOURCE)
+    f.close()
+    t = time.perf_counter()
+    subprocess.check_call([sys.executable, os.path.join(TOP, "c2ir.py"), src], cwd=workdir, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - t
+
+if __name__ == '__main__':
+    usage = "Usage: %prog [options]"
+    p = OptionParser(usage)
+    p.add_option("-n", dest="runs", type="int", default=10, help="number of measured runs")
+    p.add_option("--budget", dest="budget", type="float", default=0.3, help="allowed median wall time of one invocation in seconds")
+    opts, args = p.parse_args()
+
+    imports = [measure_import() for i in range(opts.runs)]
+    parsers = [measure_parser() for i in range(opts.runs)]
+    with tempfile.TemporaryDirectory() as workdir:
+        runs = [measure_run(workdir) for i in range(opts.runs)]
+
+    print("import c2ir      {:.4f} s".format(statistics.median(imports)))
+    print("parser setup     {:.4f} s".format(statistics.median(parsers)))
+    print("c2ir.py run      {:.4f} s (budget {:.4f} s)".format(statistics.median(runs), opts.budget))
+    if statistics.median(runs) > opts.budget:
+        print("over budget")
+        sys.exit(1)
@@ -0,0 +1,90 @@
+# generators of synthetic C sources for benchmarking c2ir.
+# Each generator takes a size parameter and returns the text of one source.
+
+def straight_line(n):
+    lines = ["int straight(int a, int b){"]
+    for i in range(8):
+        lines.append("  int t{} = a;".format(i))
+    for i in range(n):
+        lines.append("  t{} = t{} + t{} * {};".format(i % 8, (i+1) % 8, (i+3) % 8, i % 13 + 1))
+    lines.append("  return t0 + t7;")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+def nested_if(n):
+    lines = ["int nested_if(int a, int b){", "  int r = 0;"]
+    def emit(depth, indent):
+        pad = "  " * indent
+        if depth == n:
+            lines.append("{}r = r + {};".format(pad, depth))
+            return
+        lines.append("{}if(a > {}){{".format(pad, depth))
+        emit(depth+1, indent+1)
+        lines.append("{}}}else{{".format(pad))
+        lines.append("{}  r = b - {};".format(pad, depth))
+        lines.append("{}}}".format(pad))
+    emit(0, 1)
+    lines.append("  return r;")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+def nested_for(n):
+    lines = ["int nested_for(int a){", "  int s = 0;"]
+    for i in range(n):
+        lines.append("  int i{};".format(i))
+    for i in range(n):
+        lines.append("{}for(i{} = 0; i{} < 2; i{}++){{".format("  " * (i+1), i, i, i))
+    lines.append("{}s = s + a;".format("  " * (n+1)))
+    for i in reversed(range(n)):
+        lines.append("{}}}".format("  " * (i+1)))
+    lines.append("  return s;")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+def big_switch(n):
+    lines = ["int big_switch(int x, int a){", "  int r = 0;", "  switch(x){"]
+    for i in range(n):
+        lines.append("  case {}: r = a + {}; break;".format(i, i))
+    lines.append("  default: r = a;")
+    lines.append("  }")
+    lines.append("  return r;")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+def many_globals(n):
+    lines = ["int g{};".format(i) for i in range(n)]
+    lines.append("void set_globals(int a){")
+    for i in range(n):
+        lines.append("  g{} = a + {};".format(i, i))
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+def many_functions(n):
+    lines = []
+    for i in range(n):
+        lines.append("int f{}(int a, int b){{ return a * {} + b; }}".format(i, i + 1))
+    lines.append("void call_all(int a, int b){")
+    for i in range(n):
+        lines.append("  f{}(a, b);".format(i))
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+WORKLOADS = {
+    "straight_line": straight_line,
+    "nested_if": nested_if,
+    "nested_for": nested_for,
+    "big_switch": big_switch,
+    "many_globals": many_globals,
+    "many_functions": many_functions,
+}
+
+# sizes used when none are given; nesting depth grows the source much
+# faster than the other parameters
+DEFAULT_SIZES = {
+    "straight_line": [100, 1000, 5000],
+    "nested_if": [8, 32, 128],
+    "nested_for": [2, 8, 16],
+    "big_switch": [16, 256, 2048],
+    "many_globals": [100, 1000, 5000],
+    "many_functions": [10, 100, 500],
+}
@@ -1,21 +1,84 @@
 import sys
 import os
+import json
 from optparse import OptionParser
 
 from pycparser import c_parser, c_ast
 
 import ir_ast
+import ir_emit
+import ir_opt
+import ir_sched
+import ir_stats
+# the cache and the passes which only some options use are imported where
+# they are needed, to keep the start-up short
 
-def parse(src_name, module):
+BUFFER_SIZE = 1<<16
+
+parser = None
+
+def get_parser():
+    # one parser per process; pycparser 2.x (PLY) keeps its generated
+    # lex/yacc tables in the user cache directory instead of rebuilding them
+    global parser
+    if parser is None:
+        tabdir = None
+        if hasattr(c_parser, "yacc"):
+            import ir_cache
+            tabdir = os.path.join(ir_cache.default_dir(), "tables")
+            os.makedirs(tabdir, exist_ok=True)
+            if tabdir not in sys.path:
+                sys.path.insert(0, tabdir)
+        if tabdir is None:
+            parser = c_parser.CParser()
+        else:
+            parser = c_parser.CParser(lextab="c2ir_lextab", yacctab="c2ir_yacctab", taboutputdir=tabdir)
+    return parser
+
+def read_source(src_name):
     f = open(src_name)
     text = f.read()
     f.close()
-    
-    parser = c_parser.CParser()
-    ast = parser.parse(text, filename=src)
+    with ir_stats.phase("parse"):
+        return get_parser().parse(text, filename=src_name)
+
+def declare_methods(module, ast):
+    # return kinds of the functions of ast, known before any function is
+    # lowered so that calls do not depend on the order of the definitions
     for ext in ast.ext:
         if isinstance(ext, c_ast.FuncDef):
-            module.boards.append(parse_funcdef(module, ext))
+            module.methods[ext.decl.name] = conv_type(ext.decl.type.type)
+        elif isinstance(ext, c_ast.Decl) and isinstance(ext.type, c_ast.FuncDecl):
+            module.methods[ext.name] = conv_type(ext.type.type)
+
+class UnknownMethod(Exception):
+
+    def __init__(self, name):
+        Exception.__init__(self, name)
+        self.name = name
+
+def parse(src_name, module, emit=None, lower=None, ast=None, deferred=None):
+    # functions calling a method of another source are put into deferred,
+    # if given, and emitted as None, to be lowered once every source is known
+    if lower is None:
+        lower = parse_funcdef
+    if ast is None:
+        ast = read_source(src_name)
+        declare_methods(module, ast)
+    for ext in ast.ext:
+        if isinstance(ext, c_ast.FuncDef):
+            try:
+                board = lower(module, ext)
+            except UnknownMethod as e:
+                if deferred is None:
+                    print("no return value of", e.name)
+                    sys.exit(-1)
+                deferred.append(ext)
+                board = None
+            if emit is None:
+                module.boards.append(board)
+            else:
+                emit(board)
         elif isinstance(ext, c_ast.Decl):
             parse_global_decl(module, ext)
         else:
@@ -23,33 +86,198 @@ def parse(src_name, module):
 
     return module
 
+def parse_unit(src_name, module_name, opts):
+    # lowers one source in a fresh module; used by the worker processes.
+    # The functions calling methods of other sources are returned unlowered.
+    module = ir_ast.Module(module_name)
+    delays = None
+    if opts.delay_model is not None:
+        delays = ir_sched.load_delay_model(opts.delay_model)
+    cache = open_cache(opts)
+    profile = load_profile(opts)
+    if opts.stats or opts.stats_json is not None:
+        ir_stats.enable(opts.stats_memory)
+    def lower(module, func):
+        return lower_funcdef(module, func, opts, delays, cache, profile)
+    deferred = []
+    try:
+        parse(src_name, module, lower=lower, deferred=deferred)
+        phases = None
+        if ir_stats.collector is not None:
+            phases = ir_stats.collector.phases
+    finally:
+        ir_stats.disable() # the worker process runs more units
+    return module.variables, module.methods, module.boards, deferred, phases
+
+def merge_unit(module, variables, boards):
+    for v in variables:
+        if module.search_variable(v.original) is None:
+            module.declare_variable(v)
+    for board in boards:
+        if board is not None: # deferred
+            board.module = module
+    return boards
+
 def generate(dest_name, module):
-    dest = open(dest_name, "w")
+    dest = open(dest_name, "w", buffering=BUFFER_SIZE)
     module_name, _ = os.path.splitext(os.path.basename(dest_name))
-    dest.write("(MODULE {}\n".format(module_name))
-    dest.write("  (VARIABLES\n")
-    for v in module.variables:
-        dest.write("    {}\n".format(v.to_sexp()))
-    dest.write("  )\n")
+    ir_emit.write_module(dest, module_name, module.variables, module.boards)
+    dest.close()
 
+def optimize(module, opts):
+    delays = None
+    if opts.delay_model is not None:
+        delays = ir_sched.load_delay_model(opts.delay_model)
     for board in module.boards:
-        dest.write(" (BOARD {} {} \n".format(board.kind, board.name))
-        
-        dest.write("  (VARIABLES\n")
-        for v in board.variables:
-            dest.write("    {}\n".format(v.to_sexp()))
-        dest.write("  )\n")
-        
-        dest.write("  (SEQUENCER {}\n".format(board.name))
-        for s in board.slots:
-            dest.write("    {}\n".format(s.to_sexp()))
-        dest.write("  )\n")
-        dest.write(" ) \n")
-        
-    dest.write(")\n")
-    dest.close()
+        optimize_board(board, opts, delays)
+    link(module.boards, opts, delays)
+
+def needs_link(opts):
+    # whether passes over every board of the module are enabled
+    return opts.inline > 0 or opts.no_wait
+
+def link(boards, opts, delays=None):
+    if opts.inline > 0:
+        inline(boards, opts, delays)
+    if opts.no_wait:
+        import ir_calls
+        ir_calls.dispatch_calls(boards)
+
+def inline(boards, opts, delays=None):
+    # the callers which changed are scheduled again around the inlined slots
+    import ir_calls
+    changed = ir_calls.inline_calls(boards, opts.inline)
+    for board in boards:
+        if board.name in changed:
+            schedule_board(board, opts, delays)
+
+def open_cache(opts):
+    if opts.cache_dir is None and not opts.cache:
+        return None
+    import ir_cache
+    path = opts.cache_dir
+    if path is None:
+        path = ir_cache.default_dir()
+    return ir_cache.Cache(path, opts.cache_size * 1024 * 1024)
+
+def load_profile(opts):
+    if opts.profile is None:
+        return None
+    f = open(opts.profile)
+    profile = json.load(f)
+    f.close()
+    return profile["boards"]
+
+def lower_funcdef(module, func, opts, delays=None, cache=None, profile=None):
+    # lowers and optimizes one function, reusing the cached board if the
+    # function, the globals it refers to and the options did not change
+    counts = None
+    if profile is not None:
+        counts = profile.get(func.decl.name)
+    hot = None
+    if counts is not None:
+        with ir_stats.phase("lower"):
+            hot = profiled_loops(module, func, counts, opts.profile_report)
+    key = None
+    if cache is not None:
+        key = cache.key(module, func, opts, delays, counts)
+        board = cache.load(key, module)
+        if board is not None:
+            return board
+    with ir_stats.phase("lower"):
+        board = parse_funcdef(module, func, opts.unroll, hot)
+    with ir_stats.phase("optimize"):
+        optimize_board(board, opts, delays)
+    if cache is not None:
+        cache.store(key, board)
+    return board
+
+# a loop is hot when its condition is visited at least this fraction as
+# often as the most visited slot of its board
+HOT_FRACTION = 0.1
+
+def profiled_loops(module, func, counts, report=0):
+    # the source lines of the hot loops of func. The slot ids of the profile
+    # are those of func lowered without options, as it is done here.
+    board = parse_funcdef(module, func)
+    if len(board.slots) != counts["slots"]:
+        print("profile of {} does not match its slots, ignored".format(board.name))
+        return None
+    visits = {}
+    for i, n in counts["visits"].items():
+        visits[int(i)] = n
+    cycles = {}
+    for i, n in counts["cycles"].items():
+        cycles[int(i)] = n
+    if report > 0:
+        total = sum(cycles.values())
+        print("profile of {}: {} cycles".format(board.name, total))
+        for i, n in sorted(cycles.items(), key=lambda x: (-x[1], x[0]))[:report]:
+            print("  slot {} at {}:{}: {} cycles ({:.1f}%), {} visits".format(
+                i, func.coord.file, board.lines.get(i, "?"), n, 100.0 * n / max(total, 1), visits.get(i, 0)))
+    top = max(list(visits.values()) + [0])
+    hot = set()
+    for i, n in visits.items():
+        if n > 1 and n >= HOT_FRACTION * top and i in board.lines:
+            if isinstance(board.slots[i].items[-1], ir_ast.JTSlotItem):
+                hot.add(board.lines[i])
+    return hot
+
+def optimize_board(board, opts, delays=None):
+    resources = ir_sched.make_resources(opts.ram_ports)
+    if opts.balance:
+        balance_board(board, opts)
+    if opts.fold:
+        ir_opt.fold_constants(board)
+    if opts.cse:
+        ir_opt.cse(board)
+    if opts.select:
+        ir_opt.lower_selects(board)
+    if opts.if_convert:
+        ir_opt.if_convert(board)
+    if opts.narrow:
+        narrow_board(board)
+    if opts.pipeline is not None and board.name in opts.pipeline:
+        pipeline_board(board, None, opts, resources)
+    elif len(board.pipeline) > 0:
+        pipeline_board(board, board.pipeline, opts, resources)
+    schedule_board(board, opts, delays, resources)
+
+def schedule_board(board, opts, delays=None, resources=None):
+    if resources is None:
+        resources = ir_sched.make_resources(opts.ram_ports)
+    if opts.cleanup:
+        ir_opt.cleanup(board, resources)
+    if opts.schedule:
+        ir_sched.schedule(board, delays=delays, chain_budget=opts.chain_budget, resources=resources)
+    if opts.cleanup:
+        ir_opt.cleanup(board, resources)
+    if opts.regalloc:
+        ir_opt.allocate_temporaries(board)
+
+def pipeline_board(board, loops, opts, resources):
+    import ir_pipeline
+    for jt, ii, stages in ir_pipeline.pipeline(board, loops, opts.chain_budget, resources):
+        if ii is None:
+            print("loop in {} not pipelined: {}".format(board.name, stages))
+        else:
+            print("pipelined loop in {}: II {}, stages {}".format(board.name, ii, stages))
+
+def balance_board(board, opts):
+    chains, before, after = ir_opt.balance(board, opts.fast_math)
+    if chains > 0:
+        print("balanced {} chains in {}: height {} -> {}".format(chains, board.name, before, after))
+
+def narrow_board(board):
+    import ir_width
+    temps, saved, ops = ir_width.narrow(board)
+    if temps > 0 or ops > 0:
+        print("narrowed {}: {} temporaries, {} register bits saved, {} operators made 32-bit".format(board.name, temps, saved, ops))
 
 def conv_type(t):
+    if not isinstance(t, c_ast.TypeDecl):
+        print("Not supported type yet", t)
+        return "UNKNOWN"
     names = t.type.names
     if((len(names) == 1) and (names[0] == "void")):
         return "VOID"
@@ -69,28 +297,39 @@ def conv_type(t):
         return "UNKNOWN"
 
 def parse_global_decl(module, stmt):
+    if isinstance(stmt.type, c_ast.FuncDecl):
+        module.methods[stmt.name] = conv_type(stmt.type.type)
+        return None # prototype
     original_name = stmt.name
-    ir_name = original_name + "_" + module.uniq_id()
-    v = ir_ast.Variable(ir_name, conv_type(stmt.type), method="null", original=original_name, public=True, member=True)
+    if module.search_variable(original_name) is not None:
+        return None # declared again by another source
+    ir_name = original_name + "_" + module.name
+    if isinstance(stmt.type, c_ast.ArrayDecl):
+        v = ir_ast.ArrayVariable(ir_name, conv_type(stmt.type.type), array_length(stmt), method="null", original=original_name, public=True, member=True)
+    else:
+        v = ir_ast.Variable(ir_name, conv_type(stmt.type), method="null", original=original_name, public=True, member=True)
     slot = None
     if stmt.init is not None:
         # an assignment step to initialize is required
         pass
-    module.variables.append(v)
+    module.declare_variable(v)
     return slot
 
-def parse_funcdef(module, func):
+def parse_funcdef(module, func, unroll=0, hot=None):
     decl = func.decl
     method_name = decl.name
     board = ir_ast.Board(module, decl.name, conv_type(decl.type.type))
+    module.methods[decl.name] = board.kind
+    board.unroll = unroll
+    board.hot = hot
     body = func.body
     
     if decl.type.args is not None:
         for param_decl in decl.type.args.params:
             original_name = param_decl.name
-            ir_name = original_name + "_" + module.uniq_id()
+            ir_name = original_name + "_" + board.uniq_id()
             v = ir_ast.Variable(ir_name, conv_type(param_decl.type), method_param=True, method=method_name, original=original_name)
-            board.variables.append(v)
+            board.declare_variable(v)
 
     slot = board.new_slot()
     slot.append_item(ir_ast.SlotItem("METHOD_EXIT", [slot.id+1]))
@@ -108,6 +347,7 @@ def parse_funcdef(module, func):
 
 def parse_stmt(board, item):
     slot = None
+    first = len(board.slots)
     if isinstance(item, c_ast.Return):
         slot = parse_return(board, item)
     elif isinstance(item, c_ast.If):
@@ -118,6 +358,8 @@ def parse_stmt(board, item):
         slot = parse_compound(board, item)
     elif isinstance(item, c_ast.Decl):
         slot = parse_decl(board, item)
+    elif isinstance(item, c_ast.DeclList):
+        slot = parse_decllist(board, item)
     elif isinstance(item, c_ast.Switch):
         slot = parse_switch(board, item)
     #elif isinstance(item, c_ast.Case):
@@ -135,12 +377,24 @@ def parse_stmt(board, item):
         slot.append_item(ir_ast.NopSlotItem(slot.id+1))
     elif isinstance(item, c_ast.FuncCall):
         slot = parse_funccall(board, item)
+    elif isinstance(item, c_ast.Pragma):
+        board.pragmas.append(item.string.strip())
     else:
         print("Not supported stmt yet", item)
+    if item.coord is not None:
+        # inner statements took their slots first
+        for i in range(first, len(board.slots)):
+            board.lines.setdefault(i, item.coord.line)
     return slot
 
 def parse_assignement(board, stmt):
     rhs = parse_expr(board, stmt.rvalue)
+    if isinstance(stmt.lvalue, c_ast.ArrayRef):
+        array = parse_array(board, stmt.lvalue)
+        index = parse_expr(board, stmt.lvalue.subscript)
+        slot = board.new_slot()
+        slot.append_item(ir_ast.ArrayWriteSlotItem([], array, index, rhs))
+        return slot
     lhs = parse_expr(board, stmt.lvalue)
     slot = board.new_slot()
     slot.append_item(ir_ast.AssignSlotItem(lhs, rhs))
@@ -150,6 +404,7 @@ def parse_break(board, stmt):
     slot = board.new_slot()
     item = ir_ast.JPSlotItem(board.breakpoints[-1].id)
     slot.append_item(item)
+    return slot
     
 def parse_return(board, stmt):
     expr = parse_expr(board, stmt.expr)
@@ -165,30 +420,64 @@ def parse_if(board, stmt):
     slot.append_item(jt)
     
     then_id = slot.id+1
-    then_slot = parse_stmt(board, stmt.iftrue)
-    else_id = then_slot.id+1
-    else_slot = parse_stmt(board, stmt.iffalse)
-    
-    jt.next_ids = [then_id, else_id]
+    parse_stmt(board, stmt.iftrue)
+    else_id = len(board.slots)
+    if stmt.iffalse is not None:
+        parse_stmt(board, stmt.iffalse)
+    end_id = len(board.slots)
     
     slot = board.new_slot() # join slot
     slot.append_item(ir_ast.NopSlotItem(slot.id+1))
 
-    if then_slot.is_branch() == False:
-        then_slot.next_ids = [slot.id]
-    if else_slot.is_branch() == False:
-        else_slot.next_ids = [slot.id]
-    
+    # the last slot of each branch continues at the join slot
+    exits = []
+    if else_id > then_id:
+        exits.append(board.slots[else_id-1])
+    else:
+        then_id = slot.id
+    if end_id > else_id:
+        exits.append(board.slots[end_id-1])
+    else:
+        else_id = slot.id
+    jt.next_ids = [then_id, else_id]
+
+    for s in exits:
+        if s.is_branch() == False:
+            for item in s.items:
+                item.next_ids = [slot.id]
+    # jumps out of the then branch, like the exits of loops and switches
+    # ending it, fall through to the join slot instead of the else branch
+    if end_id > else_id:
+        for s in board.slots[then_id:else_id]:
+            for item in s.items:
+                item.next_ids = [slot.id if i == else_id else i for i in item.next_ids]
+
     return slot
 
 def parse_for(board, stmt):
-    init_slot = parse_stmt(board, stmt.init)
+    pragmas = board.pragmas
+    board.pragmas = []
+    # with a profile only the hot loops are unrolled and pipelined
+    hot = board.hot is not None and stmt.coord is not None and stmt.coord.line in board.hot
+    factor = unroll_factor(board, pragmas, board.hot is None or hot)
+    if factor != 0 and factor != 1:
+        trips = trip_count(stmt)
+        if trips is not None:
+            return unroll_for(board, stmt, trips, factor, pragmas)
+        elif factor != board.unroll:
+            print("loop in {} not unrolled: the trip count is unknown".format(board.name))
+
+    board.symbols.push() # scope of declarations in init
+    if stmt.init is not None:
+        parse_stmt(board, stmt.init)
     
     cond_entry = len(board.slots)
     cond = parse_expr(board, stmt.cond)
     cond_slot = board.new_slot()
     jt = ir_ast.JTSlotItem(cond)
     cond_slot.append_item(jt)
+    if "pipeline" in pragmas or hot:
+        board.pipeline.append(jt)
 
     body_id = cond_slot.id+1
     body_slot = parse_stmt(board, stmt.stmt)
@@ -201,18 +490,160 @@ def parse_for(board, stmt):
     if update_slot.is_branch() == False:
         for item in update_slot.items:
             item.next_ids = [cond_entry]
-    
+
+    board.symbols.pop()
     return slot
     
+# the largest trip count searched for by trip_count
+MAX_TRIPS = 1<<16
+
+def unroll_factor(board, pragmas, default=True):
+    # "#pragma unroll" unrolls fully, "#pragma unroll N" by N
+    factor = 0
+    if default:
+        factor = board.unroll
+    for p in pragmas:
+        words = p.split()
+        if len(words) > 0 and words[0] == "unroll":
+            if len(words) > 1:
+                factor = int(words[1])
+            else:
+                factor = -1
+    return factor
+
+def literal_value(expr):
+    if isinstance(expr, c_ast.UnaryOp) and expr.op == "-":
+        v = literal_value(expr.expr)
+        if v is None:
+            return None
+        return -v
+    elif isinstance(expr, c_ast.Constant) and expr.type == "int":
+        return ir_opt.constant_value(ir_ast.Constant(None, "INT", expr.value))
+    return None
+
+def is_counter(expr, name):
+    return isinstance(expr, c_ast.ID) and expr.name == name
+
+class CounterWriteFinder(c_ast.NodeVisitor):
+
+    # finds writes of the counter and breaks leaving the loop
+
+    def __init__(self, name):
+        self.name = name
+        self.found = False
+        self.switches = 0
+
+    def visit_Assignment(self, node):
+        if is_counter(node.lvalue, self.name):
+            self.found = True
+        self.generic_visit(node)
+
+    def visit_UnaryOp(self, node):
+        if node.op in ("p++", "p--", "++", "--") and is_counter(node.expr, self.name):
+            self.found = True
+        self.generic_visit(node)
+
+    def visit_Switch(self, node):
+        self.switches += 1
+        self.generic_visit(node)
+        self.switches -= 1
+
+    def visit_Break(self, node):
+        if self.switches == 0:
+            self.found = True
+
+def trip_count(stmt):
+    # the number of iterations of "for(i = a; i < b; i++)" and the like,
+    # where a and b are literals, or None when it is not known
+    init = stmt.init
+    if isinstance(init, c_ast.Assignment) and init.op == "=" and isinstance(init.lvalue, c_ast.ID):
+        name = init.lvalue.name
+        start = literal_value(init.rvalue)
+    elif isinstance(init, c_ast.DeclList) and len(init.decls) == 1 and init.decls[0].init is not None:
+        name = init.decls[0].name
+        start = literal_value(init.decls[0].init)
+    else:
+        return None
+    cond = stmt.cond
+    if not (isinstance(cond, c_ast.BinaryOp) and cond.op in ("<", ">") and is_counter(cond.left, name)):
+        return None
+    bound = literal_value(cond.right)
+    nxt = stmt.next
+    if isinstance(nxt, c_ast.UnaryOp) and nxt.op in ("p++", "p--") and is_counter(nxt.expr, name):
+        step = 1 if nxt.op == "p++" else -1
+    elif isinstance(nxt, c_ast.Assignment) and nxt.op == "=" and is_counter(nxt.lvalue, name) \
+         and isinstance(nxt.rvalue, c_ast.BinaryOp) and nxt.rvalue.op in ("+", "-") and is_counter(nxt.rvalue.left, name):
+        step = literal_value(nxt.rvalue.right)
+        if step is not None and nxt.rvalue.op == "-":
+            step = -step
+    else:
+        return None
+    if start is None or bound is None or step is None:
+        return None
+    finder = CounterWriteFinder(name)
+    finder.visit(stmt.stmt)
+    if finder.found:
+        return None
+    trips = 0
+    i = start
+    while (i < bound) if cond.op == "<" else (i > bound):
+        i += step
+        trips += 1
+        if trips > MAX_TRIPS:
+            return None
+    return trips
+
+def unroll_for(board, stmt, trips, factor, pragmas):
+    # full unrolling when factor is negative or covers every iteration,
+    # otherwise trips % factor iterations are peeled before a loop whose
+    # body holds factor iterations
+    board.symbols.push() # scope of declarations in init
+    slot = parse_stmt(board, stmt.init)
+    if factor < 0 or factor >= trips:
+        peel = trips
+    else:
+        peel = trips % factor
+    for k in range(peel):
+        parse_stmt(board, stmt.stmt)
+        slot = parse_stmt(board, stmt.next)
+    if peel < trips:
+        body = []
+        for k in range(factor):
+            body.append(stmt.stmt)
+            body.append(stmt.next)
+        body.pop() # the next of the loop itself
+        loop = c_ast.For(None, stmt.cond, stmt.next, c_ast.Compound(body), stmt.coord)
+        board.pragmas = [p for p in pragmas if p.split()[0] != "unroll"]
+        slot = parse_for(board, loop)
+    board.symbols.pop()
+    return slot
+
 def parse_compound(board, stmt):
     slot = None
+    board.symbols.push()
     for s in stmt.block_items:
         slot = parse_stmt(board, s)
+    board.symbols.pop()
     return slot
         
+def array_length(stmt):
+    t = stmt.type
+    if t.dim is not None:
+        length = literal_value(t.dim)
+    elif isinstance(stmt.init, c_ast.InitList):
+        length = len(stmt.init.exprs)
+    else:
+        length = None
+    if length is None or length <= 0:
+        print("array size must be a positive constant", stmt.name)
+        sys.exit(-1)
+    return length
+
 def parse_decl(board, stmt):
     original_name = stmt.name
     ir_name = original_name + "_" + board.uniq_id()
+    if isinstance(stmt.type, c_ast.ArrayDecl):
+        return parse_array_decl(board, stmt, ir_name)
     v = ir_ast.Variable(ir_name, conv_type(stmt.type), method=board.name, original=original_name)
     slot = None
     if stmt.init is not None:
@@ -220,7 +651,27 @@ def parse_decl(board, stmt):
         expr = parse_expr(board, stmt.init)
         slot = board.new_slot() # setup slot
         slot.append_item(ir_ast.AssignSlotItem(v, expr))
-    board.variables.append(v)
+    board.declare_variable(v)
+    return slot
+
+def parse_array_decl(board, stmt, ir_name):
+    v = ir_ast.ArrayVariable(ir_name, conv_type(stmt.type.type), array_length(stmt), method=board.name, original=stmt.name)
+    slot = None
+    if isinstance(stmt.init, c_ast.InitList):
+        # the elements are written one by one
+        for i, expr in enumerate(stmt.init.exprs):
+            value = parse_expr(board, expr)
+            slot = board.new_slot()
+            slot.append_item(ir_ast.ArrayWriteSlotItem([], v, board.constant("INT", i), value))
+    elif stmt.init is not None:
+        print("Not supported array initializer yet", stmt.init)
+    board.declare_variable(v)
+    return slot
+
+def parse_decllist(board, stmt):
+    slot = None
+    for d in stmt.decls:
+        slot = parse_decl(board, d)
     return slot
     
 def parse_switch(board, stmt):
@@ -235,7 +686,7 @@ def parse_switch(board, stmt):
             elif isinstance(s, c_ast.Default):
                 default = s
     elif isinstance(stmt.stmt, c_ast.Case):
-        case_entry.append(s)
+        case_entry.append(stmt.stmt)
 
     jump_slots = []
     values = []
@@ -261,7 +712,7 @@ def parse_switch(board, stmt):
         jump_slots.append(len(board.slots))
         slot = parse_case(board, default)
     else:
-        jump_losts.append(break_slot.id)
+        jump_slots.append(break_slot.id)
         
     break_slot.items[0].next_ids = [len(board.slots)]
     board.breakpoints.pop()
@@ -277,10 +728,12 @@ def parse_case(board, stmt):
 def parse_default(board, stmt):
     pass
 
-def parse_funccall(board, stmt):
-    v = ir_ast.Variable("funccall_{}".format(board.uniq_id()), "VOID", method=board.name)
+def parse_funccall(board, stmt, kind="VOID"):
+    v = ir_ast.Variable("funccall_{}".format(board.uniq_id()), kind, method=board.name)
     board.variables.append(v)
-    exprs = [parse_expr(board, e) for e in stmt.args.exprs]
+    exprs = []
+    if stmt.args is not None:
+        exprs = [parse_expr(board, e) for e in stmt.args.exprs]
     
     item = ir_ast.CallSlotItem([len(board.slots)], stmt.name.name, exprs, v)
     slot = board.new_slot()
@@ -288,9 +741,15 @@ def parse_funccall(board, stmt):
 
     return slot
 
+# integer kinds below INT are promoted to INT when they are mixed with
+# another kind, as by the usual arithmetic conversions of C
+KIND_RANKS = ["BYTE", "SHORT", "INT", "LONG", "FLOAT", "DOUBLE"]
+
 def get_kind(v0, v1):
     if v0.kind == v1.kind:
         return v0.kind
+    elif v0.kind in KIND_RANKS and v1.kind in KIND_RANKS:
+        return KIND_RANKS[max(KIND_RANKS.index(v0.kind), KIND_RANKS.index(v1.kind), KIND_RANKS.index("INT"))]
     else:
         return None
     
@@ -304,6 +763,12 @@ def parse_expr(board, expr):
         return parse_id(board, expr)
     elif isinstance(expr, c_ast.Constant):
         return parse_constant(board, expr)
+    elif isinstance(expr, c_ast.ArrayRef):
+        return parse_arrayref(board, expr)
+    elif isinstance(expr, c_ast.FuncCall):
+        return parse_funccall_expr(board, expr)
+    elif isinstance(expr, c_ast.TernaryOp):
+        return parse_ternaryop(board, expr)
     else:
         print("Not supported expr yet", expr)
         return None
@@ -322,6 +787,82 @@ def parse_binaryop(board, expr):
     slot.append_item(item)
     return v
 
+def parse_array(board, expr):
+    if not isinstance(expr.name, c_ast.ID):
+        print("Not supported array expression yet", expr.name)
+        sys.exit(-1)
+    array = parse_id(board, expr.name)
+    if not isinstance(array, ir_ast.ArrayVariable):
+        print("not an array", expr.name.name)
+        sys.exit(-1)
+    return array
+
+def parse_arrayref(board, expr):
+    array = parse_array(board, expr)
+    index = parse_expr(board, expr.subscript)
+    v = ir_ast.Variable("array_access_{}".format(board.uniq_id()), array.kind, method=board.name)
+    board.variables.append(v)
+    slot = board.new_slot()
+    slot.append_item(ir_ast.ArrayReadSlotItem([], array, index, v))
+    return v
+
+class SideEffectFinder(c_ast.NodeVisitor):
+
+    def __init__(self):
+        self.found = False
+
+    def visit_FuncCall(self, node):
+        self.found = True
+
+    def visit_Assignment(self, node):
+        self.found = True
+
+    def visit_UnaryOp(self, node):
+        self.found = True
+
+def has_side_effects(expr):
+    finder = SideEffectFinder()
+    finder.visit(expr)
+    return finder.found
+
+def parse_ternaryop(board, expr):
+    cond = parse_expr(board, expr.cond)
+    if not has_side_effects(expr.iftrue) and not has_side_effects(expr.iffalse):
+        # both values are computed and one of them is selected
+        v0 = parse_expr(board, expr.iftrue)
+        v1 = parse_expr(board, expr.iffalse)
+        v = ir_ast.Variable("cond_{}".format(board.uniq_id()), v0.kind, method=board.name)
+        board.variables.append(v)
+        slot = board.new_slot()
+        slot.append_item(ir_ast.CondSlotItem([], cond, v0, v1, v))
+        return v
+    slot = board.new_slot()
+    jt = ir_ast.JTSlotItem(cond)
+    slot.append_item(jt)
+    then_id = len(board.slots)
+    v0 = parse_expr(board, expr.iftrue)
+    v = ir_ast.Variable("cond_{}".format(board.uniq_id()), v0.kind, method=board.name)
+    board.variables.append(v)
+    then_slot = board.new_slot()
+    then_slot.append_item(ir_ast.AssignSlotItem(v, v0))
+    else_id = len(board.slots)
+    v1 = parse_expr(board, expr.iffalse)
+    slot = board.new_slot()
+    slot.append_item(ir_ast.AssignSlotItem(v, v1))
+    then_slot.items[0].next_ids = [len(board.slots)]
+    jt.next_ids = [then_id, else_id]
+    return v
+
+def parse_funccall_expr(board, expr):
+    kind = board.module.methods.get(expr.name.name)
+    if kind is None:
+        raise UnknownMethod(expr.name.name)
+    if kind == "VOID":
+        print("no return value of", expr.name.name)
+        sys.exit(-1)
+    slot = parse_funccall(board, expr, kind)
+    return slot.items[0].ret
+
 def parse_unaryop(board, expr):
     op = expr.op
     v = parse_expr(board, expr.expr)
@@ -333,9 +874,7 @@ def parse_unaryop(board, expr):
     else:
         print("not supported unary operation yet", op)
         
-    kind = "INT"
-    c = ir_ast.Constant("constant_{}".format(board.uniq_id()), kind, 1)
-    board.variables.append(c)
+    c = board.constant("INT", 1)
     slot = board.new_slot()
     item = ir_ast.BinaryOpSlotItem(ir_op, [len(board.slots)], v, c, v)
     slot.append_item(item)
@@ -345,7 +884,7 @@ def parse_id(board, expr):
     id = board.search_variable(expr.name)
     if id is None:
         print("no such symbol", expr.name)
-        exit(-1)
+        sys.exit(-1)
     return id
 
 def parse_constant(board, expr):
@@ -363,9 +902,7 @@ def parse_constant(board, expr):
         kind = "DOUBLE"
     else:
         kind = "UNKNOWN"
-    c = ir_ast.Constant("constant_{}".format(board.uniq_id()), kind, expr.value)
-    board.variables.append(c)
-    return c
+    return board.constant(kind, expr.value)
 
 def is_boolean_op(op):
     if op == "LT":
@@ -408,6 +945,17 @@ def conv_op(op, kind):
             return "DIV64"
         else:
             return "DIV32"
+    elif op == "%":
+        if kind == "LONG":
+            return "MOD64"
+        else:
+            return "MOD32"
+    elif op == "&":
+        return "AND"
+    elif op == "|":
+        return "OR"
+    elif op == "^":
+        return "XOR"
     elif op == "==":
         return "COMPEQ"
     elif op == "<":
@@ -419,25 +967,141 @@ def conv_op(op, kind):
         return "UNKNOWN"
         
     
-if __name__ == '__main__':
+def make_option_parser():
     usage = "Usage: %prog [options] C-sources"
     p = OptionParser(usage)
     p.add_option("-m", "--module", dest="module", help="specify the module name to generate")
-    opts, args = p.parse_args()
+    p.add_option("-o", "--output", dest="output", help="specify the IR file to write (default: <module>.ir)")
+    p.add_option("-j", "--jobs", dest="jobs", type="int", default=1, help="number of sources parsed in parallel")
+    p.add_option("--cache", dest="cache", action="store_true", default=False, help="reuse lowered functions from the cache directory")
+    p.add_option("--cache-dir", dest="cache_dir", help="directory of the function cache (implies --cache)")
+    p.add_option("--cache-size", dest="cache_size", type="int", default=64, help="size limit of the function cache in MB")
+    p.add_option("--stats", dest="stats", action="store_true", default=False, help="print per-phase compile statistics and a cost report per board")
+    p.add_option("--stats-json", dest="stats_json", help="write the statistics as JSON to this file")
+    p.add_option("--stats-memory", dest="stats_memory", action="store_true", default=False, help="also trace the memory allocated in each phase, which slows the phases down")
+    p.add_option("--fold", dest="fold", action="store_true", default=False, help="evaluate constant expressions and turn multiplications and divisions by powers of two into shifts")
+    p.add_option("--cse", dest="cse", action="store_true", default=False, help="reuse the results of repeated expressions")
+    p.add_option("--balance", dest="balance", action="store_true", default=False, help="reassociate chains of integer +, *, &, | and ^ into balanced trees")
+    p.add_option("--fast-math", dest="fast_math", action="store_true", default=False, help="let --balance reassociate floating-point additions and multiplications too")
+    p.add_option("--select", dest="select", action="store_true", default=False, help="turn ladders of x == c tests into one SELECT, and split SELECTs of more than {} sparse cases into dense tables".format(ir_opt.SELECT_MAX_CASES))
+    p.add_option("--if-convert", dest="if_convert", action="store_true", default=False, help="replace branches with up to {} items in each arm by COND selects".format(ir_opt.IF_CONVERT_LIMIT))
+    p.add_option("--narrow", dest="narrow", action="store_true", default=False, help="narrow temporaries and 64-bit operators to the ranges their values can take")
+    p.add_option("--inline", dest="inline", type="int", default=0, metavar="N", help="inline callees of at most N items, or a few times more inside loops (0 disables inlining)")
+    p.add_option("--no-wait-calls", dest="no_wait", action="store_true", default=False, help="go on without waiting for calls to boards of the module, joining them before the first slot depending on them")
+    p.add_option("--unroll", dest="unroll", type="int", default=0, metavar="N", help="unroll loops with a constant trip count N times (-1 unrolls fully), unless a pragma says otherwise")
+    p.add_option("--profile", dest="profile", metavar="FILE", help="slot profile written by ir_sim.py --profile for a build without options; --unroll then applies to the hot loops only, and the hot loops are pipelined")
+    p.add_option("--profile-report", dest="profile_report", type="int", default=0, metavar="N", help="print the N slots taking the most cycles in the profile, with their source lines")
+    p.add_option("--pipeline", dest="pipeline", action="append", metavar="FUNCTION", help="pipeline the counted loops of FUNCTION, may be repeated")
+    p.add_option("--cleanup", dest="cleanup", action="store_true", default=False, help="thread jumps, merge straight-line slots and remove unreachable slots")
+    p.add_option("--schedule", dest="schedule", action="store_true", default=False, help="pack independent slot items into shared slots")
+    p.add_option("--chain-budget", dest="chain_budget", type="int", default=0, help="combinational delay allowed for chained operations in a slot (0 disables chaining)")
+    p.add_option("--ram-ports", dest="ram_ports", type="int", default=1, help="ports of the memory of each array, i.e. accesses of one array per slot")
+    p.add_option("--regalloc", dest="regalloc", action="store_true", default=False, help="share registers between temporaries with disjoint lifetimes")
+    p.add_option("--delay-model", dest="delay_model", help="JSON file overriding the per-operator delays used for chaining")
+    return p
 
+def build(args, opts):
     if opts.module is not None:
         module_name = opts.module
     else:
         module_name, _ = os.path.splitext(os.path.basename(args[0]))
 
     module = ir_ast.Module(module_name)
-    dest = module_name + ".ir"
-        
-    for arg in args:
-        print("Parse {}".format(arg))
-        src = arg
-        name, ext = os.path.splitext(src)
-        parse(src, module)
-
-    print("Generate {}".format(dest))
-    generate(dest, module)
+    dest = opts.output
+    if dest is None:
+        dest = module_name + ".ir"
+
+    delays = None
+    if opts.delay_model is not None:
+        delays = ir_sched.load_delay_model(opts.delay_model)
+    cache = open_cache(opts)
+    profile = load_profile(opts)
+    stats = None
+    if opts.stats or opts.stats_json is not None:
+        stats = ir_stats.enable(opts.stats_memory)
+    try:
+        # written next to dest and renamed when done, so that a failed build
+        # leaves no partial output
+        temp = "{}.{}.tmp".format(dest, os.getpid())
+        dest_file = open(temp, "w", buffering=BUFFER_SIZE)
+        writer = ir_emit.IRWriter(dest_file, module_name)
+        def lower(module, func):
+            return lower_funcdef(module, func, opts, delays, cache, profile)
+        def write(board):
+            ir_stats.record_board(board)
+            with ir_stats.phase("emit"):
+                writer.add_board(board)
+        boards = []
+        def emit(board):
+            if needs_link(opts):
+                boards.append(board) # linking needs every board of the module
+            else:
+                write(board)
+
+        try:
+            if opts.jobs > 1:
+                from concurrent.futures import ProcessPoolExecutor # only needed here, slow to import
+                pool = ProcessPoolExecutor(opts.jobs)
+                try:
+                    units = list(pool.map(parse_unit, args, [module_name] * len(args), [opts] * len(args)))
+                finally:
+                    pool.shutdown()
+                # the functions calling methods of other sources are lowered
+                # here once the methods of all sources are known, as a serial
+                # build knows them, and emitted in the order of the sources
+                for variables, methods, unit_boards, deferred, phases in units:
+                    module.methods.update(methods)
+                for arg, (variables, methods, unit_boards, deferred, phases) in zip(args, units):
+                    print("Parse {}".format(arg))
+                    if stats is not None:
+                        stats.merge(phases)
+                    deferred = iter(deferred)
+                    for board in merge_unit(module, variables, unit_boards):
+                        if board is None:
+                            try:
+                                board = lower(module, next(deferred))
+                            except UnknownMethod as e:
+                                print("no return value of", e.name)
+                                sys.exit(-1)
+                        emit(board)
+            else:
+                asts = []
+                for arg in args:
+                    ast = read_source(arg)
+                    declare_methods(module, ast)
+                    asts.append(ast)
+                for arg, ast in zip(args, asts):
+                    print("Parse {}".format(arg))
+                    parse(arg, module, emit, lower, ast)
+            if needs_link(opts):
+                with ir_stats.phase("optimize"):
+                    link(boards, opts, delays)
+                for board in boards:
+                    write(board)
+
+            print("Generate {}".format(dest))
+            with ir_stats.phase("emit"):
+                writer.close(module.variables)
+        except BaseException:
+            dest_file.close()
+            os.remove(temp)
+            raise
+        dest_file.close()
+        os.replace(temp, dest)
+        if cache is not None:
+            cache.trim()
+        if stats is not None:
+            report = stats.report()
+            if opts.stats:
+                sys.stdout.write(ir_stats.format_text(report))
+            if opts.stats_json is not None:
+                ir_stats.write_json(report, opts.stats_json)
+    finally:
+        # a resident server goes on with tracing off and no stale collector
+        ir_stats.disable()
+    return dest
+
+if __name__ == '__main__':
+    p = make_option_parser()
+    opts, args = p.parse_args()
+    build(args, opts)
@@ -0,0 +1,47 @@
+import json
+import os
+import socket
+import sys
+
+# Drop-in replacement of "python c2ir.py ..." which hands the arguments to a
+# running c2ir_server.py, and compiles in this process when there is none.
+
+def default_socket():
+    path = os.environ.get("C2IR_SOCKET")
+    if path is not None:
+        return path
+    base = os.environ.get("XDG_RUNTIME_DIR")
+    if base is None:
+        base = "/tmp"
+    return os.path.join(base, "c2ir-{}.sock".format(os.getuid()))
+
+def request(path, args):
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(path)
+        line = json.dumps({"cwd": os.getcwd(), "args": args}) + "\n"
+        s.sendall(line.encode())
+        f = s.makefile("rb")
+        reply = f.readline()
+        f.close()
+    finally:
+        s.close()
+    return json.loads(reply.decode())
+
+def compile_locally(args):
+    import c2ir
+    p = c2ir.make_option_parser()
+    opts, args = p.parse_args(args)
+    c2ir.build(args, opts)
+
+if __name__ == '__main__':
+    path = default_socket()
+    try:
+        reply = request(path, sys.argv[1:])
+    except (OSError, ValueError):
+        compile_locally(sys.argv[1:])
+        sys.exit(0)
+    sys.stdout.write(reply["log"])
+    if reply["status"] != "ok":
+        sys.stderr.write(reply["message"] + "\n")
+        sys.exit(1)
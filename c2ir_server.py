@@ -0,0 +1,88 @@
+import io
+import json
+import os
+import signal
+import socketserver
+import sys
+import traceback
+from contextlib import redirect_stdout
+from optparse import OptionParser
+
+import c2ir
+from c2ir_client import default_socket
+
+# Keeps the parser and the lowering code resident and compiles on request.
+#
+# A request is one line of JSON:
+#   {"cwd": "/path/to/build", "args": ["-m", "top", "-o", "top.ir", "a.c", "b.c"]}
+# where args are the command line arguments of c2ir.py. The reply is one line:
+#   {"status": "ok", "output": "top.ir", "log": "Parse a.c\n..."}
+#   {"status": "error", "message": "...", "log": "..."}
+
+def handle_request(line):
+    log = io.StringIO()
+    cwd = os.getcwd()
+    try:
+        request = json.loads(line)
+        os.chdir(request.get("cwd", cwd))
+        parser = c2ir.make_option_parser()
+        opts, args = parser.parse_args(request["args"])
+        if len(args) == 0:
+            raise ValueError("no C-sources given")
+        with redirect_stdout(log):
+            dest = c2ir.build(args, opts)
+        reply = {"status": "ok", "output": dest, "log": log.getvalue()}
+    except SystemExit as e:
+        reply = {"status": "error", "message": "exit {}".format(e.code), "log": log.getvalue()}
+    except Exception:
+        reply = {"status": "error", "message": traceback.format_exc(), "log": log.getvalue()}
+    finally:
+        os.chdir(cwd)
+    return json.dumps(reply)
+
+def serve_stdin(src, dest):
+    for line in src:
+        if line.strip() == "":
+            continue
+        dest.write(handle_request(line) + "\n")
+        dest.flush()
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            if line.strip() == b"":
+                continue
+            reply = handle_request(line.decode())
+            self.wfile.write((reply + "\n").encode())
+            self.wfile.flush()
+
+def serve_socket(path):
+    if os.path.exists(path):
+        os.remove(path)
+    server = socketserver.UnixStreamServer(path, RequestHandler)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.remove(path)
+
+if __name__ == '__main__':
+    usage = "Usage: %prog [options]"
+    p = OptionParser(usage)
+    p.add_option("--stdin", dest="stdin", action="store_true", default=False, help="read requests from stdin and write replies to stdout")
+    p.add_option("--socket", dest="socket", help="path of the Unix socket to listen on")
+    opts, args = p.parse_args()
+
+    c2ir.get_parser()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    if opts.stdin:
+        serve_stdin(sys.stdin, sys.stdout)
+    else:
+        path = opts.socket
+        if path is None:
+            path = default_socket()
+        try:
+            serve_socket(path)
+        except KeyboardInterrupt:
+            pass
@@ -30,3 +30,44 @@ int for_test(int c, int a){
   return sum;
 }
 
+int if_for_test(int c, int a){
+  int i;
+  int sum = 0;
+  if(c == 1){
+    for(i = 0; i < 3; i++){
+      sum = sum + a;
+    }
+  }else{
+    sum = 5;
+  }
+  return sum;
+}
+
+int if_switch_test(int c, int x){
+  int ret = 0;
+  if(c == 1){
+    switch(x){
+    case 0: ret = 7; break;
+    default: ret = 8; break;
+    }
+  }else{
+    ret = 5;
+  }
+  return ret;
+}
+
+int if_const_test(int a){
+  if(1){
+    a = a + 1;
+  }else{
+    a = a + 2;
+  }
+  if(0){
+    a = a + 4;
+  }
+  if(1 + 1 == 2){
+    a = a + 8;
+  }
+  return a;
+}
+
@@ -1,12 +1,40 @@
 
+class SymbolTable:
+
+    # nested C block scopes, innermost last; lookups fall back to the parent table
+    __slots__ = ('scopes', 'parent')
+    def __init__(self, parent=None):
+        self.scopes = [{}]
+        self.parent = parent
+
+    def push(self):
+        self.scopes.append({})
+
+    def pop(self):
+        self.scopes.pop()
+
+    def declare(self, v):
+        self.scopes[-1][v.original] = v
+
+    def lookup(self, name):
+        for scope in reversed(self.scopes):
+            v = scope.get(name)
+            if v is not None:
+                return v
+        if self.parent is not None:
+            return self.parent.lookup(name)
+        return None
+
 class Module:
 
-    __slots__ = ('name', 'boards', 'uniq_counter', 'variables')
+    __slots__ = ('name', 'boards', 'uniq_counter', 'variables', 'symbols', 'methods')
     def __init__(self, name):
         self.name = name
         self.boards = []
         self.uniq_counter = 0
         self.variables = []
+        self.symbols = SymbolTable()
+        self.methods = {} # return kinds of the declared functions
     
     def uniq_id(self):
         i = self.uniq_counter
@@ -14,32 +42,55 @@ class Module:
         return "{}_{}".format(self.name, i)
 
     def search_variable(self, name):
-        for v in self.variables:
-            if name == v.original:
-                return v
-        return None
+        return self.symbols.lookup(name)
+
+    def declare_variable(self, v):
+        self.variables.append(v)
+        self.symbols.declare(v)
 
 class Board:
     
-    __slots__ = ('name', 'kind', 'variables', 'module', 'slots', 'breakpoints')
+    __slots__ = ('name', 'kind', 'variables', 'module', 'slots', 'breakpoints', 'constants', 'symbols', 'uniq_counter', 'pragmas', 'pipeline', 'unroll', 'hot', 'lines')
     def __init__(self, module, name, kind):
         self.name = name
         self.kind = kind
         self.module = module
+        self.uniq_counter = 0
         self.variables = []
         self.slots = []
         self.breakpoints = []
+        self.constants = {}
+        self.symbols = SymbolTable(module.symbols)
+        self.pragmas = [] # pragmas for the next loop
+        self.pipeline = [] # JT items of the loops to pipeline
+        self.unroll = 0 # unroll factor of counted loops without a pragma
+        self.hot = None # source lines of the hot loops, when profiled
+        self.lines = {} # slot id -> source line, as lowered
 
+    # ids are numbered per board, so that the names in a board do not
+    # depend on which other functions were lowered before it
     def uniq_id(self):
-        i = self.module.uniq_counter
-        self.module.uniq_counter += 1
+        i = self.uniq_counter
+        self.uniq_counter += 1
         return "{}_{}".format(self.name, i)
 
     def search_variable(self, name):
-        for v in self.variables:
-            if name == v.original:
-                return v
-        return self.module.search_variable(name)
+        return self.symbols.lookup(name)
+
+    def declare_variable(self, v):
+        self.variables.append(v)
+        self.symbols.declare(v)
+
+    def constant(self, kind, value):
+        # integer literals are keyed by value, so that 0x10 and 16 are one
+        n = literal_value(kind, value)
+        key = (kind, str(value) if n is None else n)
+        c = self.constants.get(key)
+        if c is None:
+            c = Constant("constant_{}".format(self.uniq_id()), kind, value)
+            self.constants[key] = c
+            self.variables.append(c)
+        return c
 
     def new_slot(self):
         slot = Slot(len(self.slots))
@@ -67,12 +118,27 @@ class Variable:
     def to_sexp(self):
         return "(VAR {} {} :public {} :global_constant {} :method_param {} :original {} :method {} :private_method {} :volatile {} :member {})".format(self.kind, self.name, self.conv_flag(self.public), self.conv_flag(self.global_constant), self.conv_flag(self.method_param), self.original, self.method, self.conv_flag(self.private_method), self.conv_flag(self.volatile), self.conv_flag(self.member))
 
+    def is_temporary(self):
+        # temporaries are created without a C name of their own
+        return self.original == self.name and not self.method_param and not self.member
+
     def conv_flag(self, f):
         if f == True:
             return "true"
         else:
             return "false"
 
+class ArrayVariable(Variable):
+
+    # an array held in a memory object; kind is the kind of the elements
+    __slots__ = ('length')
+    def __init__(self, name, kind, length, **kwargs):
+        super().__init__(name, kind, **kwargs)
+        self.length = length
+
+    def to_sexp(self):
+        return "(VAR (ARRAY {} {}) {} :public {} :global_constant {} :method_param {} :original {} :method {} :private_method {} :volatile {} :member {})".format(self.kind, self.length, self.name, self.conv_flag(self.public), self.conv_flag(self.global_constant), self.conv_flag(self.method_param), self.original, self.method, self.conv_flag(self.private_method), self.conv_flag(self.volatile), self.conv_flag(self.member))
+
 class Constant:
     __slots__ = ('name', 'kind', 'value', 'original')
     def __init__(self, name, kind, value):
@@ -84,6 +150,20 @@ class Constant:
     def to_sexp(self):
         return "(CONSTANT {} {} {})".format(self.kind, self.name, self.value)
 
+WIDTHS = {"BYTE": 8, "SHORT": 16, "INT": 32, "LONG": 64}
+
+def literal_value(kind, value):
+    # integer value of a C literal of kind, or None when it is not one
+    if kind not in WIDTHS:
+        return None
+    s = str(value).rstrip("uUlL")
+    try:
+        if len(s) > 1 and s[0] == "0" and s[1] not in "xXbB":
+            return int(s, 8)
+        return int(s, 0)
+    except ValueError:
+        return None
+
 class Slot:
     __slots__ = ('id', 'items')
     def __init__(self, id):
@@ -91,11 +171,9 @@ class Slot:
         self.items = []
     
     def to_sexp(self):
-        str = "(SLOT {}".format(self.id)
-        for item in self.items:
-            str = str + " " + item.to_sexp()
-        str += ")"
-        return str
+        parts = ["(SLOT {}".format(self.id)]
+        parts.extend([item.to_sexp() for item in self.items])
+        return " ".join(parts) + ")"
 
     def is_branch(self):
         for item in self.items:
@@ -107,6 +185,14 @@ class Slot:
         self.items.append(item)
         if item.is_branch() == False:
             item.next_ids = [self.id+1]
+
+    def successors(self):
+        for item in reversed(self.items):
+            if item.is_branch():
+                return item.next_ids
+        if len(self.items) > 0:
+            return self.items[0].next_ids
+        return []
     
 class SlotItem:
     __slots__ = ('op', 'next_ids')
@@ -119,17 +205,21 @@ class SlotItem:
         return str
 
     def next_ids_str(self):
-        str = ":next ("
-        sep = ""
-        for i in self.next_ids:
-            str += "{}{}".format(sep, i)
-            sep = " "
-        str += ")"
-        return str
+        return ":next ({})".format(" ".join([str(i) for i in self.next_ids]))
 
     def is_branch(self):
         return False
 
+    def uses(self):
+        return []
+
+    def defs(self):
+        return []
+
+    def substitute(self, table):
+        # replaces the variables found by name in table
+        pass
+
 class AssignSlotItem(SlotItem):
     __slots__ = ('lhs', 'rhs')
     def __init__(self, lhs, rhs):
@@ -141,6 +231,16 @@ class AssignSlotItem(SlotItem):
         str = "(SET {} (ASSIGN {}) {})".format(self.lhs.name, self.rhs.name, self.next_ids_str())
         return str
 
+    def uses(self):
+        return [self.rhs]
+
+    def defs(self):
+        return [self.lhs]
+
+    def substitute(self, table):
+        self.lhs = table.get(self.lhs.name, self.lhs)
+        self.rhs = table.get(self.rhs.name, self.rhs)
+
 class ReturnSlotItem(SlotItem):
     __slots__ = ('v')
     def __init__(self, v):
@@ -154,6 +254,12 @@ class ReturnSlotItem(SlotItem):
     def is_branch(self):
         return True
 
+    def uses(self):
+        return [self.v]
+
+    def substitute(self, table):
+        self.v = table.get(self.v.name, self.v)
+
 class BinaryOpSlotItem(SlotItem):
     __slots__ = ('binary_op', 'next_ids', 'v0', 'v1', 'ret')
     def __init__(self, binary_op, next_ids, v0, v1, ret):
@@ -167,6 +273,44 @@ class BinaryOpSlotItem(SlotItem):
         str = "({} {} ({} {} {}) {})".format(self.op, self.ret.name, self.binary_op, self.v0.name, self.v1.name, self.next_ids_str())
         return str
 
+    def uses(self):
+        return [self.v0, self.v1]
+
+    def defs(self):
+        return [self.ret]
+
+    def substitute(self, table):
+        self.v0 = table.get(self.v0.name, self.v0)
+        self.v1 = table.get(self.v1.name, self.v1)
+        self.ret = table.get(self.ret.name, self.ret)
+
+class CondSlotItem(SlotItem):
+
+    # ret = cond ? v0 : v1
+    __slots__ = ('cond', 'v0', 'v1', 'ret')
+    def __init__(self, next_ids, cond, v0, v1, ret):
+        super().__init__("SET", next_ids)
+        self.cond = cond
+        self.v0 = v0
+        self.v1 = v1
+        self.ret = ret
+
+    def to_sexp(self):
+        str = "({} {} (COND {} {} {}) {})".format(self.op, self.ret.name, self.cond.name, self.v0.name, self.v1.name, self.next_ids_str())
+        return str
+
+    def uses(self):
+        return [self.cond, self.v0, self.v1]
+
+    def defs(self):
+        return [self.ret]
+
+    def substitute(self, table):
+        self.cond = table.get(self.cond.name, self.cond)
+        self.v0 = table.get(self.v0.name, self.v0)
+        self.v1 = table.get(self.v1.name, self.v1)
+        self.ret = table.get(self.ret.name, self.ret)
+
 class JTSlotItem(SlotItem):
     
     __slots__ = ('cond')
@@ -181,6 +325,12 @@ class JTSlotItem(SlotItem):
     def is_branch(self):
         return True
 
+    def uses(self):
+        return [self.cond]
+
+    def substitute(self, table):
+        self.cond = table.get(self.cond.name, self.cond)
+
 class JPSlotItem(SlotItem):
     
     __slots__ = ('next_id')
@@ -206,24 +356,104 @@ class NopSlotItem(SlotItem):
     
 class CallSlotItem(SlotItem):
     
-    __slots__ = ('next_ids', 'name', 'args', 'ret')
-    def __init__(self, next_ids, name, args, ret):
+    # with no_wait the caller goes on while the callee runs; ret is then
+    # defined by the JoinSlotItem of the call
+    __slots__ = ('next_ids', 'name', 'args', 'ret', 'no_wait')
+    def __init__(self, next_ids, name, args, ret, no_wait=False):
         super().__init__("SET", next_ids)
         self.name = name
         self.args = args
         self.ret = ret
+        self.no_wait = no_wait
     
     def to_sexp(self):
-        args = "("
-        src = ""
-        for a in self.args:
-            args += a.name + " "
-            src += " " + a.name
-        args += ")"
-        
-        str = "({} {} (CALL {} :no_wait false :name {} :args {}) {})".format(self.op, self.ret.name, src, self.name, args, self.next_ids_str())
+        args = "({})".format("".join([a.name + " " for a in self.args]))
+        src = "".join([" " + a.name for a in self.args])
+        no_wait = "true" if self.no_wait else "false"
+        str = "({} {} (CALL {} :no_wait {} :name {} :args {}) {})".format(self.op, self.ret.name, src, no_wait, self.name, args, self.next_ids_str())
+        return str
+
+    def uses(self):
+        return list(self.args)
+
+    def defs(self):
+        if self.no_wait:
+            return []
+        return [self.ret]
+
+    def substitute(self, table):
+        self.args = [table.get(a.name, a) for a in self.args]
+        self.ret = table.get(self.ret.name, self.ret)
+
+class JoinSlotItem(SlotItem):
+
+    # waits for a call made with no_wait to finish and takes its result
+    __slots__ = ('name', 'ret')
+    def __init__(self, next_ids, name, ret):
+        super().__init__("SET", next_ids)
+        self.name = name
+        self.ret = ret
+
+    def to_sexp(self):
+        str = "({} {} (JOIN :name {}) {})".format(self.op, self.ret.name, self.name, self.next_ids_str())
+        return str
+
+    def defs(self):
+        return [self.ret]
+
+    def substitute(self, table):
+        self.ret = table.get(self.ret.name, self.ret)
+
+class ArrayReadSlotItem(SlotItem):
+
+    # reads are taken as uses of the whole array, writes as uses and
+    # definitions of it, so that accesses of one array keep their order
+    __slots__ = ('array', 'index', 'ret')
+    def __init__(self, next_ids, array, index, ret):
+        super().__init__("SET", next_ids)
+        self.array = array
+        self.index = index
+        self.ret = ret
+
+    def to_sexp(self):
+        str = "({} {} (ARRAY_ACCESS {} {}) {})".format(self.op, self.ret.name, self.array.name, self.index.name, self.next_ids_str())
         return str
 
+    def uses(self):
+        return [self.array, self.index]
+
+    def defs(self):
+        return [self.ret]
+
+    def substitute(self, table):
+        self.array = table.get(self.array.name, self.array)
+        self.index = table.get(self.index.name, self.index)
+        self.ret = table.get(self.ret.name, self.ret)
+
+class ArrayWriteSlotItem(SlotItem):
+
+    __slots__ = ('array', 'index', 'value')
+    def __init__(self, next_ids, array, index, value):
+        super().__init__("SET", next_ids)
+        self.array = array
+        self.index = index
+        self.value = value
+
+    def to_sexp(self):
+        str = "({} (ARRAY_INDEX {} {}) (ASSIGN {}) {})".format(self.op, self.array.name, self.index.name, self.value.name, self.next_ids_str())
+        return str
+
+    def uses(self):
+        return [self.array, self.index, self.value]
+
+    def defs(self):
+        return [self.array]
+
+    def substitute(self, table):
+        self.array = table.get(self.array.name, self.array)
+        self.index = table.get(self.index.name, self.index)
+        self.value = table.get(self.value.name, self.value)
+
 class SelectSlotItem(SlotItem):
     
     __slots__ = ('next_ids', 'values', 'key')
@@ -233,13 +463,7 @@ class SelectSlotItem(SlotItem):
         self.key = key
     
     def patterns_str(self):
-        str = ":patterns ("
-        sep = ""
-        for v in self.values:
-            str += "{}{}".format(sep, v.name)
-            sep = " "
-        str += ")"
-        return str
+        return ":patterns ({})".format(" ".join([v.name for v in self.values]))
     
     def to_sexp(self):
         str = "({} {} :target {} {} {})".format(self.op, self.key.name, self.key.name, self.patterns_str(), self.next_ids_str())
@@ -247,3 +471,10 @@ class SelectSlotItem(SlotItem):
 
     def is_branch(self):
         return True
+
+    def uses(self):
+        return [self.key] + list(self.values)
+
+    def substitute(self, table):
+        self.key = table.get(self.key.name, self.key)
+        self.values = [table.get(v.name, v) for v in self.values]
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import pickle
+
+from pycparser import c_ast, c_generator
+
+import ir_ast
+
+DEFAULT_SIZE = 64 * 1024 * 1024
+
+# options which only change how the driver runs, not the generated IR
+DRIVER_OPTIONS = ('module', 'output', 'jobs', 'cache', 'cache_dir', 'cache_size', 'stats', 'stats_json', 'stats_memory', 'profile_report')
+
+def default_dir():
+    base = os.environ.get("XDG_CACHE_HOME")
+    if base is None:
+        base = os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "c2ir")
+
+def tool_version():
+    # every module of the tool takes part, so that any change of the
+    # lowering or of a pass invalidates the cached boards
+    h = hashlib.sha256()
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in sorted(os.listdir(here)):
+        if name == "c2ir.py" or (name.startswith("ir_") and name.endswith(".py")):
+            f = open(os.path.join(here, name), "rb")
+            h.update(f.read())
+            f.close()
+    return h.hexdigest()
+
+class NameCollector(c_ast.NodeVisitor):
+
+    def __init__(self):
+        self.names = set()
+
+    def visit_ID(self, node):
+        self.names.add(node.name)
+
+class Cache:
+
+    def __init__(self, path, max_size=DEFAULT_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.version = tool_version()
+        self.generator = c_generator.CGenerator()
+        os.makedirs(path, exist_ok=True)
+
+    def key(self, module, func, opts, delays=None, profile=None):
+        h = hashlib.sha256()
+        h.update(self.version.encode())
+        h.update(module.name.encode())
+        h.update(self.generator.visit(func).encode())
+        collector = NameCollector()
+        collector.visit(func)
+        for name in sorted(collector.names):
+            v = module.search_variable(name)
+            if v is not None:
+                h.update("{} {} {}\n".format(name, v.name, v.kind).encode())
+            # return kinds of the called methods are used by the lowering
+            kind = module.methods.get(name)
+            if kind is not None:
+                h.update("method {} {}\n".format(name, kind).encode())
+        settings = sorted([(k, v) for k, v in vars(opts).items() if k not in DRIVER_OPTIONS])
+        h.update(repr(settings).encode())
+        if delays is not None:
+            h.update(repr(sorted(delays.items())).encode())
+        if profile is not None:
+            h.update(json.dumps(profile, sort_keys=True).encode())
+        return h.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.path, key + ".pickle")
+
+    def load(self, key, module):
+        path = self.entry_path(key)
+        try:
+            f = open(path, "rb")
+            board = pickle.load(f)
+            f.close()
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        os.utime(path) # keeps recently used entries from being evicted
+        board.module = module
+        board.symbols = ir_ast.SymbolTable(module.symbols)
+        return board
+
+    def store(self, key, board):
+        module, symbols = board.module, board.symbols
+        board.module, board.symbols = None, None
+        try:
+            data = pickle.dumps(board, pickle.HIGHEST_PROTOCOL)
+        finally:
+            board.module, board.symbols = module, symbols
+        path = self.entry_path(key)
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        f = open(tmp, "wb")
+        f.write(data)
+        f.close()
+        os.replace(tmp, path)
+
+    def trim(self):
+        # evicts least recently used entries until the cache fits in max_size
+        entries = []
+        total = 0
+        for name in os.listdir(self.path):
+            if not name.endswith(".pickle"):
+                continue
+            path = os.path.join(self.path, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
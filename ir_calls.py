@@ -0,0 +1,311 @@
+import copy
+
+import ir_ast
+import ir_cfg
+import ir_opt
+
+# module level passes over the calls between boards
+
+# calls inside a loop inline callees this many times the size threshold
+HOT_LOOP_FACTOR = 4
+
+def board_size(board):
+    # the items doing work, without entry, exit and plain jumps
+    n = 0
+    for s in board.slots:
+        for item in s.items:
+            if item.op == "METHOD_ENTRY" or item.op == "METHOD_EXIT":
+                continue
+            if isinstance(item, (ir_ast.JPSlotItem, ir_ast.NopSlotItem)):
+                continue
+            n += 1
+    return n
+
+def callees(board):
+    names = set()
+    for s in board.slots:
+        for item in s.items:
+            if isinstance(item, ir_ast.CallSlotItem):
+                names.add(item.name)
+    return names
+
+def call_order(boards):
+    # boards ordered so that callees come before their callers, as far as
+    # call cycles allow
+    by_name = {}
+    for board in boards:
+        by_name[board.name] = board
+    order = []
+    seen = set()
+    def visit(board):
+        seen.add(board.name)
+        for name in sorted(callees(board)):
+            if name in by_name and name not in seen:
+                visit(by_name[name])
+        order.append(board)
+    for board in boards:
+        if board.name not in seen:
+            visit(board)
+    return order
+
+def in_loop(board, slot_id):
+    # whether slot_id can be reached again from its own successors
+    seen = set()
+    work = list(board.slots[slot_id].successors())
+    while len(work) > 0:
+        i = work.pop()
+        if i == slot_id:
+            return True
+        if i in seen or i >= len(board.slots):
+            continue
+        seen.add(i)
+        work.extend(board.slots[i].successors())
+    return False
+
+def copy_variable(caller, v):
+    # a variable of the callee as a new variable of the caller
+    if v.is_temporary():
+        name = "inline_{}".format(caller.uniq_id())
+        original = None
+    else:
+        name = "{}_{}".format(v.original, caller.uniq_id())
+        original = v.original
+    if isinstance(v, ir_ast.ArrayVariable):
+        nv = ir_ast.ArrayVariable(name, v.kind, v.length, method=caller.name, original=original)
+    else:
+        nv = ir_ast.Variable(name, v.kind, method=caller.name, original=original)
+    caller.variables.append(nv)
+    return nv
+
+def inline_call(caller, slot, callee, tag):
+    # replaces the call in slot with a copy of the slots of callee; returns
+    # the (key, slot) entries of the copy
+    call = slot.items[0]
+    cont = call.next_ids[0]
+    table = {}
+    params = []
+    for v in callee.variables:
+        if isinstance(v, ir_ast.Constant):
+            table[v.name] = caller.constant(v.kind, v.value)
+        elif not v.member:
+            table[v.name] = copy_variable(caller, v)
+            if v.method_param:
+                params.append(table[v.name])
+
+    def key(i):
+        if i == 0:
+            return cont
+        return (tag, i)
+
+    entry = callee.slots[1].items[0].next_ids[0]
+    # the arguments are passed in one slot, as the parameters are fresh
+    items = []
+    for p, a in zip(params, call.args):
+        item = ir_ast.AssignSlotItem(p, a)
+        item.next_ids = [key(entry)]
+        items.append(item)
+    if len(items) == 0:
+        items.append(ir_ast.NopSlotItem(key(entry)))
+    slot.items = items
+
+    entries = []
+    for s in callee.slots[2:]:
+        new = ir_ast.Slot(None)
+        for item in s.items:
+            if isinstance(item, ir_ast.ReturnSlotItem):
+                if item.v is not None and call.ret.kind != "VOID":
+                    item = ir_ast.AssignSlotItem(call.ret, table.get(item.v.name, item.v))
+                else:
+                    item = ir_ast.NopSlotItem(0)
+                item.next_ids = [0]
+            else:
+                item = copy.copy(item)
+                item.substitute(table)
+            item.next_ids = [key(i) for i in item.next_ids]
+            new.items.append(item)
+        entries.append((key(s.id), new))
+    return entries
+
+def inline_calls(boards, threshold):
+    # inlines calls of boards whose size is at most threshold, or
+    # threshold * HOT_LOOP_FACTOR for calls inside a loop. Returns the
+    # names of the boards that changed.
+    by_name = {}
+    for board in boards:
+        by_name[board.name] = board
+    changed = []
+    n = 0
+    for caller in call_order(boards):
+        # the calls are picked before any is replaced, as the replaced
+        # slots jump to keys instead of slot ids
+        calls = []
+        for s in caller.slots:
+            if len(s.items) != 1 or not isinstance(s.items[0], ir_ast.CallSlotItem):
+                continue
+            callee = by_name.get(s.items[0].name)
+            if callee is None or callee is caller:
+                continue
+            limit = threshold
+            if in_loop(caller, s.id):
+                limit = threshold * HOT_LOOP_FACTOR
+            if board_size(callee) <= limit:
+                calls.append((s, callee))
+        entries = [(s.id, s) for s in caller.slots]
+        for s, callee in calls:
+            entries.extend(inline_call(caller, s, callee, "inline_{}".format(n)))
+            n += 1
+        if len(entries) > len(caller.slots):
+            ir_cfg.rebuild(caller, entries)
+            ir_opt.prune_variables(caller)
+            changed.append(caller.name)
+    return changed
+
+def board_effects(boards):
+    # (reads, writes, calls) of each board: the globals it reads and writes
+    # and the boards it calls, with those of its callees included. Boards
+    # calling outside of boards have no entry, as their effects are unknown.
+    effects = {}
+    for board in boards:
+        reads = set()
+        writes = set()
+        for s in board.slots:
+            for item in s.items:
+                reads.update([v.name for v in item.uses() if getattr(v, "member", False)])
+                writes.update([v.name for v in item.defs() if getattr(v, "member", False)])
+        effects[board.name] = (reads, writes, callees(board))
+    changed = True
+    while changed:
+        changed = False
+        for name in list(effects.keys()):
+            reads, writes, calls = effects[name]
+            for callee in list(calls):
+                e = effects.get(callee)
+                if e is None:
+                    del effects[name]
+                    changed = True
+                    break
+                n = len(reads) + len(writes) + len(calls)
+                reads |= e[0]
+                writes |= e[1]
+                calls |= e[2]
+                if len(reads) + len(writes) + len(calls) != n:
+                    changed = True
+    return effects
+
+def item_effects(item, effects):
+    # (uses, defs, calls) of item, or None if they are unknown
+    if isinstance(item, ir_ast.CallSlotItem):
+        e = effects.get(item.name)
+        if e is None:
+            return None
+        return (set(ir_cfg.use_names(item)) | e[0], set([item.ret.name]) | e[1], e[2] | set([item.name]))
+    elif isinstance(item, ir_ast.JoinSlotItem):
+        return (set(), set([item.ret.name]), set([item.name]))
+    return (set(ir_cfg.use_names(item)), set(ir_cfg.def_names(item)), set())
+
+def slot_effects(slot, effects):
+    # (uses, defs, calls) of the items of slot, or None if they are unknown
+    uses = set()
+    defs = set()
+    calls = set()
+    for item in slot.items:
+        e = item_effects(item, effects)
+        if e is None:
+            return None
+        uses |= e[0]
+        defs |= e[1]
+        calls |= e[2]
+    return (uses, defs, calls)
+
+def call_windows(board, preds, effects):
+    # the last slot which can run while each call is going on, and the slot
+    # the call has to be joined before, by the id of the slot of the call.
+    # The window is straight-line code not touching the result of the call
+    # or the globals it uses. The straight-line paths are walked once
+    # backwards, keeping the nearest slot using, defining or calling each
+    # name, so the effects of every slot are computed once.
+    def straight(i):
+        if i == 0 or i >= len(board.slots) or len(preds[i]) != 1:
+            return False
+        s = board.slots[i]
+        if len(s.successors()) != 1 or s.items[0].op == "METHOD_EXIT":
+            return False
+        return not any([isinstance(item, ir_ast.ReturnSlotItem) for item in s.items])
+    windows = {}
+    for head in board.slots:
+        if not straight(head.id) or straight(preds[head.id][0]):
+            continue
+        path = [head.id]
+        while straight(board.slots[path[-1]].successors()[0]):
+            path.append(board.slots[path[-1]].successors()[0])
+        path.append(board.slots[path[-1]].successors()[0]) # where the path ends
+        # the nearest position on the path using, defining or calling a name
+        used = {}
+        defined = {}
+        called = {}
+        unknown = len(path) - 1
+        for n in range(len(path) - 2, -1, -1):
+            e = slot_effects(board.slots[path[n]], effects)
+            if e is None:
+                unknown = n
+            else:
+                for name in e[0]:
+                    used[name] = n
+                for name in e[1]:
+                    defined[name] = n
+                for name in e[2]:
+                    called[name] = n
+            slot = board.slots[preds[path[n]][0]]
+            if len(slot.items) != 1 or not isinstance(slot.items[0], ir_ast.CallSlotItem):
+                continue
+            call = slot.items[0]
+            if call.name not in effects:
+                continue
+            reads, writes, calls = effects[call.name]
+            busy = writes | set([call.ret.name])
+            end = unknown
+            for name in busy:
+                end = min(end, used.get(name, end), defined.get(name, end))
+            for name in reads:
+                end = min(end, defined.get(name, end))
+            for name in calls | set([call.name]):
+                end = min(end, called.get(name, end))
+            if end == n:
+                windows[slot.id] = (slot.id, path[end])
+            else:
+                windows[slot.id] = (path[end - 1], path[end])
+    return windows
+
+def dispatch_calls(boards):
+    # calls to boards of the module go on without waiting up to the first
+    # slot depending on them, where a JoinSlotItem is put. Returns the names
+    # of the boards that changed.
+    effects = board_effects(boards)
+    changed = []
+    for board in boards:
+        preds = ir_cfg.predecessors(board)
+        found = call_windows(board, preds, effects)
+        windows = []
+        for s in board.slots:
+            if s.id not in found or s.items[0].no_wait:
+                continue
+            prev, stop = found[s.id]
+            if prev != s.id:
+                windows.append((s, prev, stop))
+        if len(windows) == 0:
+            continue
+        entries = [(s.id, s) for s in board.slots]
+        last = {} # the slot jumping to stop on the edge from prev
+        for n, (s, prev, stop) in enumerate(windows):
+            call = s.items[0]
+            call.no_wait = True
+            key = ("join", n)
+            slot = ir_ast.Slot(None)
+            slot.items.append(ir_ast.JoinSlotItem([stop], call.name, call.ret))
+            for item in last.get((prev, stop), board.slots[prev]).items:
+                item.next_ids = [key if i == stop else i for i in item.next_ids]
+            last[(prev, stop)] = slot
+            entries.append((key, slot))
+        ir_cfg.rebuild(board, entries)
+        changed.append(board.name)
+    return changed
@@ -0,0 +1,120 @@
+import ir_ast
+
+# helpers to look at Board.slots as a control flow graph
+
+def is_special(item):
+    if item.op == "METHOD_ENTRY" or item.op == "METHOD_EXIT":
+        return True
+    elif isinstance(item, (ir_ast.CallSlotItem, ir_ast.JoinSlotItem)):
+        return True
+    return False
+
+def is_special_slot(slot):
+    for item in slot.items:
+        if is_special(item):
+            return True
+    return False
+
+def use_names(item):
+    return [v.name for v in item.uses() if not isinstance(v, ir_ast.Constant)]
+
+def def_names(item):
+    return [v.name for v in item.defs()]
+
+def predecessors(board):
+    preds = {}
+    for s in board.slots:
+        preds[s.id] = []
+    for s in board.slots:
+        for n in s.successors():
+            if n in preds and s.id not in preds[n]:
+                preds[n].append(s.id)
+    return preds
+
+def reachable(board):
+    seen = set()
+    work = [0]
+    while len(work) > 0:
+        i = work.pop()
+        if i in seen or i >= len(board.slots):
+            continue
+        seen.add(i)
+        work.extend(board.slots[i].successors())
+    return seen
+
+def basic_blocks(board):
+    # straight line runs of slots: every slot but the last has exactly
+    # one successor, which has no other predecessor
+    preds = predecessors(board)
+    blocks = []
+    done = set()
+    for s in board.slots:
+        if s.id in done:
+            continue
+        block = [s.id]
+        done.add(s.id)
+        cur = s
+        while not is_special_slot(cur) and not cur.is_branch():
+            succ = cur.successors()
+            if len(succ) != 1:
+                break
+            n = succ[0]
+            if n in done or n >= len(board.slots) or len(preds[n]) != 1:
+                break
+            nxt = board.slots[n]
+            if is_special_slot(nxt):
+                break
+            block.append(n)
+            done.add(n)
+            cur = nxt
+        blocks.append(block)
+    return blocks
+
+def rebuild(board, entries):
+    # entries is a list of (key, slot); every next id in the slots is a key,
+    # which is replaced by the position of the corresponding slot
+    id_map = {}
+    for i, (key, slot) in enumerate(entries):
+        id_map[key] = i
+    slots = []
+    for i, (key, slot) in enumerate(entries):
+        slot.id = i
+        for item in slot.items:
+            item.next_ids = [id_map[n] for n in item.next_ids]
+        slots.append(slot)
+    board.slots = slots
+    return id_map
+
+def liveness(board, names=None):
+    # live variables at the end of each slot; items of a slot are taken in
+    # order. When names is given only those variables are tracked.
+    gen = []
+    kill = []
+    for s in board.slots:
+        g = set()
+        k = set()
+        for item in s.items:
+            for u in use_names(item):
+                if u not in k and (names is None or u in names):
+                    g.add(u)
+            for d in def_names(item):
+                if names is None or d in names:
+                    k.add(d)
+        gen.append(g)
+        kill.append(k)
+    live_in = [set() for s in board.slots]
+    live_out = [set() for s in board.slots]
+    changed = True
+    while changed:
+        changed = False
+        for s in reversed(board.slots):
+            out = set()
+            for n in s.successors():
+                if n < len(board.slots):
+                    out |= live_in[n]
+            new_in = gen[s.id] | (out - kill[s.id])
+            if len(new_in) != len(live_in[s.id]) or len(out) != len(live_out[s.id]):
+                live_in[s.id] = new_in
+                live_out[s.id] = out
+                changed = True
+    return live_out
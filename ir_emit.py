@@ -0,0 +1,53 @@
+import shutil
+import tempfile
+
+# serialization of Synthesijer-IR.
+# Every function returns or yields whole lines, so that the output can be
+# written in large chunks instead of one write per line.
+
+def variables_chunk(variables, indent):
+    lines = ["{}(VARIABLES\n".format(indent)]
+    lines.extend(["{}  {}\n".format(indent, v.to_sexp()) for v in variables])
+    lines.append("{})\n".format(indent))
+    return "".join(lines)
+
+def board_chunk(board):
+    lines = [" (BOARD {} {} \n".format(board.kind, board.name)]
+    lines.append(variables_chunk(board.variables, "  "))
+    lines.append("  (SEQUENCER {}\n".format(board.name))
+    lines.extend(["    {}\n".format(s.to_sexp()) for s in board.slots])
+    lines.append("  )\n")
+    lines.append(" ) \n")
+    return "".join(lines)
+
+def iter_module(module_name, variables, boards):
+    yield "(MODULE {}\n".format(module_name)
+    yield variables_chunk(variables, "  ")
+    for board in boards:
+        yield board_chunk(board)
+    yield ")\n"
+
+def write_module(dest, module_name, variables, boards):
+    for chunk in iter_module(module_name, variables, boards):
+        dest.write(chunk)
+
+class IRWriter:
+
+    # Boards are serialized as soon as they are added and are not kept.
+    # The module variables precede the boards in the output, so the board
+    # text is spooled (in memory up to spool_size, then on disk) until close().
+    def __init__(self, dest, module_name, spool_size=1<<22):
+        self.dest = dest
+        self.module_name = module_name
+        self.spool = tempfile.SpooledTemporaryFile(max_size=spool_size, mode="w+")
+
+    def add_board(self, board):
+        self.spool.write(board_chunk(board))
+
+    def close(self, variables):
+        self.dest.write("(MODULE {}\n".format(self.module_name))
+        self.dest.write(variables_chunk(variables, "  "))
+        self.spool.seek(0)
+        shutil.copyfileobj(self.spool, self.dest)
+        self.spool.close()
+        self.dest.write(")\n")
@@ -0,0 +1,1029 @@
+import copy
+
+import ir_ast
+import ir_cfg
+import ir_sched
+
+def is_jump_only(slot):
+    if len(slot.items) == 0:
+        return False
+    for item in slot.items:
+        if not isinstance(item, (ir_ast.JPSlotItem, ir_ast.NopSlotItem)):
+            return False
+    return len(slot.successors()) == 1 and not ir_cfg.is_special_slot(slot)
+
+def thread_jumps(board):
+    targets = {}
+    def forward(i):
+        if i in targets:
+            return targets[i]
+        seen = set()
+        n = i
+        while n < len(board.slots) and is_jump_only(board.slots[n]) and n not in seen:
+            seen.add(n)
+            n = board.slots[n].successors()[0]
+        targets[i] = n
+        return n
+    for s in board.slots:
+        for item in s.items:
+            item.next_ids = [forward(n) for n in item.next_ids]
+
+def can_merge(a, b, resources=None):
+    if resources is None:
+        resources = ir_sched.RESOURCES
+    if ir_cfg.is_special_slot(a) or ir_cfg.is_special_slot(b) or a.is_branch():
+        return False
+    defs = set()
+    usage = {}
+    for item in a.items:
+        defs.update(ir_cfg.def_names(item))
+        kind, res = ir_sched.item_resource(item)
+        usage[res] = usage.get(res, 0) + 1
+    for item in b.items:
+        if len(defs & set(ir_cfg.use_names(item))) > 0:
+            return False
+        if len(defs & set(ir_cfg.def_names(item))) > 0:
+            return False
+        kind, res = ir_sched.item_resource(item)
+        usage[res] = usage.get(res, 0) + 1
+        if kind in resources and usage[res] > resources[kind]:
+            return False
+    return True
+
+def merge_slots(board, resources=None):
+    merged = True
+    while merged:
+        merged = False
+        preds = ir_cfg.predecessors(board)
+        for a in board.slots:
+            succ = a.successors()
+            if len(succ) != 1 or succ[0] == a.id or succ[0] >= len(board.slots):
+                continue
+            b = board.slots[succ[0]]
+            if len(preds[b.id]) != 1 or not can_merge(a, b, resources):
+                continue
+            items = [item for item in b.items if not isinstance(item, (ir_ast.JPSlotItem, ir_ast.NopSlotItem))]
+            if len(items) == 0:
+                items = b.items
+            a.items = [item for item in a.items if not isinstance(item, ir_ast.NopSlotItem)] + items
+            targets = b.successors()
+            for item in a.items:
+                if not item.is_branch():
+                    item.next_ids = list(targets[:1])
+            b.items = []
+            preds[b.id] = []
+            for n in targets:
+                if n in preds:
+                    preds[n] = [a.id if p == b.id else p for p in preds[n]]
+            merged = True
+
+def remove_unreachable(board):
+    live = ir_cfg.reachable(board)
+    entries = [(s.id, s) for s in board.slots if s.id in live]
+    ir_cfg.rebuild(board, entries)
+
+def cleanup(board, resources=None):
+    thread_jumps(board)
+    merge_slots(board, resources)
+    thread_jumps(board)
+    remove_unreachable(board)
+    return board
+
+def interference(board, temps):
+    edges = {}
+    for t in temps:
+        edges[t] = set()
+    live_out = ir_cfg.liveness(board, temps)
+    for s in board.slots:
+        live = set(live_out[s.id])
+        slot_defs = []
+        for item in reversed(s.items):
+            defs = [d for d in ir_cfg.def_names(item) if d in temps]
+            for d in defs:
+                for u in live:
+                    if u != d:
+                        edges[d].add(u)
+                        edges[u].add(d)
+                live.discard(d)
+            for u in ir_cfg.use_names(item):
+                if u in temps:
+                    live.add(u)
+            slot_defs.extend(defs)
+        # registers written in the same slot must differ
+        for d in slot_defs:
+            for e in slot_defs:
+                if d != e:
+                    edges[d].add(e)
+    return edges
+
+def allocate_temporaries(board):
+    # lets temporaries of the same kind share one variable when their
+    # lifetimes do not overlap, then drops unreferenced temporaries and constants
+    temps = {}
+    for v in board.variables:
+        if isinstance(v, ir_ast.Variable) and v.is_temporary():
+            temps[v.name] = v
+    edges = interference(board, temps)
+    registers = [] # (representative, member names)
+    table = {}
+    for v in board.variables:
+        if v.name not in temps:
+            continue
+        for rep, members in registers:
+            if rep.kind == v.kind and edges[v.name].isdisjoint(members):
+                members.add(v.name)
+                table[v.name] = rep
+                break
+        else:
+            registers.append((v, set([v.name])))
+    for s in board.slots:
+        for item in s.items:
+            item.substitute(table)
+    prune_variables(board)
+    return board
+
+def prune_variables(board):
+    used = set()
+    for s in board.slots:
+        for item in s.items:
+            used.update([v.name for v in item.uses()])
+            used.update([v.name for v in item.defs()])
+    variables = []
+    for v in board.variables:
+        if isinstance(v, ir_ast.Constant) or v.is_temporary():
+            if v.name not in used:
+                continue
+        variables.append(v)
+    board.variables = variables
+    for key, c in list(board.constants.items()):
+        if c.name not in used:
+            del board.constants[key]
+
+COMMUTATIVE = set(["ADD", "MUL32", "MUL64", "COMPEQ", "FADD32", "FADD64", "FMUL32", "FMUL64"])
+
+def expr_key(item):
+    a = item.v0.name
+    b = item.v1.name
+    if item.binary_op in COMMUTATIVE and b < a:
+        a, b = b, a
+    return (item.binary_op, a, b)
+
+def is_value_item(item):
+    # a binary operation into a temporary that does not read its own result
+    if not isinstance(item, ir_ast.BinaryOpSlotItem):
+        return False
+    if not (isinstance(item.ret, ir_ast.Variable) and item.ret.is_temporary()):
+        return False
+    return item.ret.name != item.v0.name and item.ret.name != item.v1.name
+
+MASK_PAIRS = 8
+
+class Available:
+
+    # the expressions of a board as bits: bit n of a set stands for the nth
+    # (expression, temporary) pair. The pairs of each expression and the
+    # pairs invalidated when a name is written are kept as bit numbers, as
+    # a mask takes as many bits as the whole set; only expressions and names
+    # of more than MASK_PAIRS pairs get a mask.
+
+    def __init__(self, board, members):
+        self.pairs = []
+        self.index = {}
+        self.by_key = {}
+        self.by_name = {}
+        for s in board.slots:
+            for item in s.items:
+                if not is_value_item(item):
+                    continue
+                key = expr_key(item)
+                pair = (key, item.ret.name)
+                if pair in self.index:
+                    continue
+                n = len(self.pairs)
+                self.index[pair] = n
+                self.pairs.append(pair)
+                self.by_key.setdefault(key, []).append(n)
+                for name in (key[1], key[2], item.ret.name):
+                    self.by_name.setdefault(name, []).append(n)
+        self.masks = {}
+        for table in (self.by_key, self.by_name):
+            for k, bits in table.items():
+                if len(bits) > MASK_PAIRS:
+                    mask = 0
+                    for n in bits:
+                        mask |= 1 << n
+                    self.masks[k] = mask
+        self.members = 0 # the pairs a callee may invalidate
+        for name in members:
+            for n in self.by_name.get(name, ()):
+                self.members |= 1 << n
+
+    def holder(self, state, key):
+        # the temporary holding key in state, or None
+        if key in self.masks:
+            bits = state & self.masks[key]
+            if bits == 0:
+                return None
+            return self.pairs[bits.bit_length() - 1][1]
+        for n in self.by_key.get(key, ()):
+            if state >> n & 1:
+                return self.pairs[n][1]
+        return None
+
+    def transfer(self, state, item):
+        for name in ir_cfg.def_names(item):
+            if name in self.masks:
+                state &= ~self.masks[name]
+                continue
+            for n in self.by_name.get(name, ()):
+                if state >> n & 1:
+                    state ^= 1 << n
+        if isinstance(item, (ir_ast.CallSlotItem, ir_ast.JoinSlotItem)):
+            state &= ~self.members
+        if is_value_item(item):
+            key = expr_key(item)
+            if self.holder(state, key) is None:
+                state |= 1 << self.index[(key, item.ret.name)]
+        return state
+
+def available_expressions(board, blocks, avail):
+    # the expressions available at the head of each block
+    preds = ir_cfg.predecessors(board)
+    block_of = {}
+    for b, block in enumerate(blocks):
+        for i in block:
+            block_of[i] = b
+    avail_in = [None for block in blocks]
+    avail_out = [None for block in blocks]
+    changed = True
+    while changed:
+        changed = False
+        for b, block in enumerate(blocks):
+            if block[0] <= 1:
+                state = 0
+            else:
+                state = None
+                for p in preds[block[0]]:
+                    out = avail_out[block_of[p]]
+                    if out is None:
+                        continue
+                    if state is None:
+                        state = out
+                    else:
+                        state &= out
+                if state is None:
+                    continue
+            avail_in[b] = state
+            for i in block:
+                for item in board.slots[i].items:
+                    state = avail.transfer(state, item)
+            if avail_out[b] != state:
+                avail_out[b] = state
+                changed = True
+    return avail_in
+
+def eliminate_common_subexpressions(board):
+    members = set()
+    defs = {}
+    uses = {}
+    for s in board.slots:
+        for item in s.items:
+            for v in item.uses() + item.defs():
+                if isinstance(v, ir_ast.Variable) and v.member:
+                    members.add(v.name)
+            for d in ir_cfg.def_names(item):
+                defs[d] = defs.get(d, 0) + 1
+            for u in ir_cfg.use_names(item):
+                uses.setdefault(u, []).append(item)
+    # position of every item in its straight-line block
+    blocks = ir_cfg.basic_blocks(board)
+    position = {}
+    for b, block in enumerate(blocks):
+        k = 0
+        for i in block:
+            for item in board.slots[i].items:
+                position[id(item)] = (b, k)
+                k += 1
+
+    def replaceable(item, holder):
+        # every use of the redundant temporary must follow it in the same
+        # block, where holder (defined once) cannot change
+        t = item.ret.name
+        if defs.get(t) != 1 or defs.get(holder) != 1:
+            return False
+        b, k = position[id(item)]
+        for use in uses.get(t, []):
+            ub, uk = position.get(id(use), (None, None))
+            if ub != b or uk < k:
+                return False
+        return True
+
+    avail = Available(board, members)
+    avail_in = available_expressions(board, blocks, avail)
+    table = {}
+    removed = set()
+    for b, block in enumerate(blocks):
+        if avail_in[b] is None:
+            continue
+        state = avail_in[b]
+        for i in block:
+            for item in board.slots[i].items:
+                if is_value_item(item):
+                    holder = avail.holder(state, expr_key(item))
+                    if holder is not None and holder != item.ret.name and replaceable(item, holder):
+                        table[item.ret.name] = find_variable(board, holder)
+                        removed.add(id(item))
+                        continue
+                state = avail.transfer(state, item)
+    if len(removed) == 0:
+        return False
+    for s in board.slots:
+        items = [item for item in s.items if id(item) not in removed]
+        if len(items) == 0:
+            items = [ir_ast.NopSlotItem(s.items[0].next_ids[0])]
+        s.items = items
+        for item in s.items:
+            item.substitute(table)
+    return True
+
+def find_variable(board, name):
+    for v in board.variables:
+        if v.name == name:
+            return v
+    return None
+
+def cse(board):
+    while eliminate_common_subexpressions(board):
+        pass
+    prune_variables(board)
+    return board
+
+# bit widths of the integer kinds folded with C semantics
+WIDTHS = ir_ast.WIDTHS
+
+def constant_value(c):
+    # integer value of a Constant, or None when it is not an integer literal
+    if not isinstance(c, ir_ast.Constant):
+        return None
+    return ir_ast.literal_value(c.kind, c.value)
+
+def wrap(value, kind):
+    w = WIDTHS[kind]
+    value &= (1 << w) - 1
+    if value >= 1 << (w - 1):
+        value -= 1 << w
+    return value
+
+def c_div(a, b):
+    # C division truncates toward zero
+    q = abs(a) // abs(b)
+    if (a < 0) != (b < 0):
+        q = -q
+    return q
+
+def evaluate(op, a, b, kind):
+    if op == "ADD":
+        return wrap(a + b, kind)
+    elif op == "SUB":
+        return wrap(a - b, kind)
+    elif op == "MUL32" or op == "MUL64":
+        return wrap(a * b, kind)
+    elif (op == "DIV32" or op == "DIV64") and b != 0:
+        return wrap(c_div(a, b), kind)
+    elif (op == "MOD32" or op == "MOD64") and b != 0:
+        return wrap(a - c_div(a, b) * b, kind)
+    elif op == "AND":
+        return wrap(a & b, kind)
+    elif op == "OR":
+        return wrap(a | b, kind)
+    elif op == "XOR":
+        return wrap(a ^ b, kind)
+    elif op == "LT":
+        return a < b
+    elif op == "GT":
+        return a > b
+    elif op == "COMPEQ":
+        return a == b
+    return None
+
+def log2(value):
+    # k when value is 2**k with k > 0, otherwise None
+    if value is None or value < 2 or value & (value - 1) != 0:
+        return None
+    return value.bit_length() - 1
+
+def shift_op(name, kind):
+    if kind == "LONG":
+        return name + "64"
+    return name + "32"
+
+def new_temporary(board, kind):
+    v = ir_ast.Variable("binary_op_{}".format(board.uniq_id()), kind, method=board.name)
+    board.variables.append(v)
+    return v
+
+def divide_by_power(board, item, k, remainder):
+    # signed x / 2**k rounds toward zero: a bias of 2**k-1 is added to
+    # negative dividends before the arithmetic shift
+    x = item.v0
+    ret = item.ret
+    kind = ret.kind
+    sign = new_temporary(board, kind)
+    bias = new_temporary(board, kind)
+    biased = new_temporary(board, kind)
+    items = [ir_ast.BinaryOpSlotItem(shift_op("SIMPLE_ARITH_RSHIFT", kind), [], x, board.constant("INT", WIDTHS[kind] - 1), sign),
+             ir_ast.BinaryOpSlotItem("AND", [], sign, board.constant(kind, (1 << k) - 1), bias),
+             ir_ast.BinaryOpSlotItem("ADD", [], x, bias, biased)]
+    if remainder:
+        rounded = new_temporary(board, kind)
+        items.append(ir_ast.BinaryOpSlotItem("AND", [], biased, board.constant(kind, -(1 << k)), rounded))
+        items.append(ir_ast.BinaryOpSlotItem("SUB", [], x, rounded, ret))
+    else:
+        items.append(ir_ast.BinaryOpSlotItem(shift_op("SIMPLE_ARITH_RSHIFT", kind), [], biased, board.constant("INT", k), ret))
+    return items
+
+def reduce_item(board, item, defs, branches):
+    # returns the items replacing item, or None when it is kept
+    if not isinstance(item, ir_ast.BinaryOpSlotItem):
+        return None
+    op = item.binary_op
+    kind = item.ret.kind
+    a = constant_value(item.v0)
+    b = constant_value(item.v1)
+    if a is not None and b is not None:
+        value = evaluate(op, a, b, kind) if kind in WIDTHS or kind == "BOOLEAN" else None
+        if value is None:
+            return None
+        if isinstance(value, bool):
+            # a folded comparison only goes away when branches use it
+            if defs.get(item.ret.name) != 1 or item.ret.name not in branches:
+                return None
+            branches[item.ret.name] = value
+            return []
+        return [ir_ast.AssignSlotItem(item.ret, board.constant(kind, value))]
+    if kind not in WIDTHS:
+        return None
+    if op == "MUL32" or op == "MUL64":
+        if a is not None:
+            x, c = item.v1, a
+        else:
+            x, c = item.v0, b
+        if c == 1:
+            return [ir_ast.AssignSlotItem(item.ret, x)]
+        elif c == 0:
+            return [ir_ast.AssignSlotItem(item.ret, board.constant(kind, 0))]
+        elif log2(c) is not None:
+            return [ir_ast.BinaryOpSlotItem(shift_op("SIMPLE_LSHIFT", kind), [], x, board.constant("INT", log2(c)), item.ret)]
+    elif op == "ADD" and (a == 0 or b == 0):
+        return [ir_ast.AssignSlotItem(item.ret, item.v1 if a == 0 else item.v0)]
+    elif op == "SUB" and b == 0:
+        return [ir_ast.AssignSlotItem(item.ret, item.v0)]
+    elif op == "DIV32" or op == "DIV64":
+        if b == 1:
+            return [ir_ast.AssignSlotItem(item.ret, item.v0)]
+        elif log2(b) is not None:
+            return divide_by_power(board, item, log2(b), False)
+    elif op == "MOD32" or op == "MOD64":
+        if b == 1:
+            return [ir_ast.AssignSlotItem(item.ret, board.constant(kind, 0))]
+        elif log2(b) is not None:
+            return divide_by_power(board, item, log2(b), True)
+    return None
+
+def condition_value(c):
+    # whether a constant condition holds, or None when it is not known
+    if c.kind == "BOOLEAN":
+        return str(c.value) == "true"
+    value = constant_value(c)
+    if value is None:
+        return None
+    return value != 0
+
+def fold_pass(board):
+    defs = {}
+    uses = {}
+    jumps = {}
+    for s in board.slots:
+        for item in s.items:
+            for d in ir_cfg.def_names(item):
+                defs[d] = defs.get(d, 0) + 1
+            for u in ir_cfg.use_names(item):
+                uses[u] = uses.get(u, 0) + 1
+            if isinstance(item, ir_ast.JTSlotItem) and not isinstance(item.cond, ir_ast.Constant):
+                jumps[item.cond.name] = jumps.get(item.cond.name, 0) + 1
+    # conditions read by nothing but branches, filled in when folded
+    branches = {}
+    for name, n in jumps.items():
+        if uses[name] == n:
+            branches[name] = None
+
+    table = {}
+    entries = []
+    changed = False
+    for s in board.slots:
+        items = []
+        for item in s.items:
+            item.substitute(table)
+            taken = None
+            if isinstance(item, ir_ast.JTSlotItem):
+                if isinstance(item.cond, ir_ast.Constant):
+                    taken = condition_value(item.cond)
+                else:
+                    taken = branches.get(item.cond.name)
+            if taken is not None:
+                target = item.next_ids[0] if taken else item.next_ids[1]
+                items.append(ir_ast.JPSlotItem(target))
+                changed = True
+                continue
+            new = reduce_item(board, item, defs, branches)
+            if new is None or (len(new) > 1 and len(s.items) > 1):
+                items.append(item)
+                continue
+            changed = True
+            if len(new) == 1 and isinstance(new[0], ir_ast.AssignSlotItem):
+                rhs = new[0].rhs
+                if item.ret.is_temporary() and defs.get(item.ret.name) == 1 and isinstance(rhs, ir_ast.Constant):
+                    # a temporary holding a constant is replaced by it
+                    table[item.ret.name] = rhs
+                    continue
+            for n in new:
+                n.next_ids = list(item.next_ids)
+            items.extend(new)
+        if len(items) == 0:
+            items = [ir_ast.NopSlotItem(s.items[0].next_ids[0])]
+        if len(s.items) == 1 and len(items) > 1:
+            # a sequence of dependent items takes a slot each
+            for j, item in enumerate(items):
+                slot = s if j == 0 else ir_ast.Slot(None)
+                slot.items = [item]
+                key = s.id if j == 0 else (s.id, j)
+                if j + 1 < len(items):
+                    item.next_ids = [(s.id, j + 1)]
+                entries.append((key, slot))
+        else:
+            s.items = items
+            entries.append((s.id, s))
+    if changed:
+        ir_cfg.rebuild(board, entries)
+        for s in board.slots:
+            for item in s.items:
+                item.substitute(table)
+    return changed
+
+def fold_constants(board):
+    while fold_pass(board):
+        pass
+    prune_variables(board)
+    return board
+
+# if-conversion: the arms of a short branch are both computed into fresh
+# temporaries, and the variables they write are selected by COND items
+# after them, so that no JT and join slots are left
+
+IF_CONVERT_LIMIT = 4 # items of each arm
+
+def convertible(item):
+    if isinstance(item, (ir_ast.JPSlotItem, ir_ast.NopSlotItem)):
+        return True
+    if not isinstance(item, (ir_ast.BinaryOpSlotItem, ir_ast.AssignSlotItem, ir_ast.CondSlotItem)):
+        return False
+    # multi-cycle operators are not worth computing when not needed
+    if ir_sched.item_op(item) not in ir_sched.DELAYS:
+        return False
+    return not any([v.volatile for v in item.defs()])
+
+def branch_arm(board, start, jt_id, preds):
+    # the straight-line slots from start up to the first slot which is also
+    # entered from elsewhere, and that slot; None if they cannot be converted
+    arm = []
+    prev = jt_id
+    i = start
+    while i != jt_id and i < len(board.slots) and preds[i] == [prev]:
+        s = board.slots[i]
+        if ir_cfg.is_special_slot(s) or len(s.successors()) != 1:
+            return None, None
+        for item in s.items:
+            if not convertible(item):
+                return None, None
+        arm.append(i)
+        prev = i
+        i = s.successors()[0]
+    return arm, i
+
+def arm_size(board, arm):
+    return len([item for i in arm for item in board.slots[i].items if not isinstance(item, (ir_ast.JPSlotItem, ir_ast.NopSlotItem))])
+
+def rename_arm(board, arm, keys, next_key):
+    # copies of the slots of arm writing fresh temporaries; returns the
+    # entries and the table from the written names to the temporaries
+    table = {}
+    entries = []
+    for n, i in enumerate(arm):
+        slot = ir_ast.Slot(None)
+        following = keys[n + 1] if n + 1 < len(keys) else next_key
+        for item in board.slots[i].items:
+            if isinstance(item, (ir_ast.JPSlotItem, ir_ast.NopSlotItem)):
+                continue
+            # the names written are those before renaming, as a variable
+            # written again is already renamed by substitute
+            defs = item.defs()
+            item = copy.copy(item)
+            item.substitute(table)
+            for d in defs:
+                if d.name not in table:
+                    table[d.name] = new_temporary(board, d.kind)
+                if isinstance(item, ir_ast.AssignSlotItem):
+                    item.lhs = table[d.name]
+                else:
+                    item.ret = table[d.name]
+            item.next_ids = [following]
+            slot.items.append(item)
+        if len(slot.items) == 0:
+            slot.items.append(ir_ast.NopSlotItem(following))
+        entries.append((keys[n], slot))
+    return entries, table
+
+def convert_branch(board, j, then_arm, else_arm, join, used_in, tag):
+    jt = board.slots[j].items[0]
+    arms = [then_arm, else_arm]
+    keys = [[(tag, a, n) for n in range(len(arm))] for a, arm in enumerate(arms)]
+    entries = []
+    tables = []
+    variables = {}
+    for a, arm in enumerate(arms):
+        next_key = keys[1][0] if a == 0 and len(keys[1]) > 0 else (tag, "select", 0)
+        e, table = rename_arm(board, arm, keys[a], next_key)
+        entries.extend(e)
+        tables.append(table)
+        for i in arm:
+            for item in board.slots[i].items:
+                for d in item.defs():
+                    variables[d.name] = d
+    # temporaries only read inside their arm are not selected
+    names = []
+    for a, arm in enumerate(arms):
+        for name in tables[a]:
+            v = variables[name]
+            if name in names or (v.is_temporary() and used_in.get(name, set()) <= set(arm)):
+                continue
+            names.append(name)
+    selects = []
+    for n, name in enumerate(names):
+        v = variables[name]
+        slot = ir_ast.Slot(None)
+        following = (tag, "select", n + 1) if n + 1 < len(names) else join
+        slot.items.append(ir_ast.CondSlotItem([following], jt.cond, tables[0].get(name, v), tables[1].get(name, v), v))
+        selects.append(((tag, "select", n), slot))
+    if len(selects) == 0:
+        selects.append(((tag, "select", 0), ir_ast.Slot(None)))
+        selects[0][1].items.append(ir_ast.NopSlotItem(join))
+    board.slots[j].items = [ir_ast.NopSlotItem((keys[0] + keys[1] + [(tag, "select", 0)])[0])]
+    return entries + selects
+
+def if_convert_pass(board):
+    preds = ir_cfg.predecessors(board)
+    used_in = {}
+    for s in board.slots:
+        for item in s.items:
+            for name in ir_cfg.use_names(item):
+                used_in.setdefault(name, set()).add(s.id)
+    touched = set()
+    removed = set()
+    entries = []
+    for s in board.slots:
+        if len(s.items) != 1 or not isinstance(s.items[0], ir_ast.JTSlotItem) or s.id in touched:
+            continue
+        then_id, else_id = s.items[0].next_ids
+        then_arm, then_end = branch_arm(board, then_id, s.id, preds)
+        else_arm, else_end = branch_arm(board, else_id, s.id, preds)
+        if then_arm is None or else_arm is None or then_end != else_end:
+            continue
+        if len(then_arm) + len(else_arm) == 0 or then_end == s.id:
+            continue
+        if arm_size(board, then_arm) > IF_CONVERT_LIMIT or arm_size(board, else_arm) > IF_CONVERT_LIMIT:
+            continue
+        if touched & set(then_arm + else_arm):
+            continue
+        entries.extend(convert_branch(board, s.id, then_arm, else_arm, then_end, used_in, ("if", s.id)))
+        touched.update([s.id] + then_arm + else_arm)
+        removed.update(then_arm + else_arm)
+    if len(entries) == 0:
+        return False
+    ir_cfg.rebuild(board, [(s.id, s) for s in board.slots if s.id not in removed] + entries)
+    return True
+
+def if_convert(board):
+    # inner branches first, which may leave the outer ones short enough
+    while if_convert_pass(board):
+        pass
+    prune_variables(board)
+    return board
+
+# dispatch on one key: ladders of x == c tests become a SELECT, and
+# SELECTs with many sparse cases are split into dense tables found by
+# comparing the key against the first case of each table
+
+SELECT_MAX_CASES = 16 # larger SELECTs are split when sparse
+SELECT_MAX_GAP = 4 # cases further apart start a new table
+
+def single_item(slot):
+    if len(slot.items) == 1:
+        return slot.items[0]
+    return None
+
+def compare_key(item):
+    # (key, constant) of an x == c test
+    if not isinstance(item, ir_ast.BinaryOpSlotItem) or item.binary_op != "COMPEQ":
+        return None
+    if constant_value(item.v1) is not None and not isinstance(item.v0, ir_ast.Constant):
+        return item.v0, item.v1
+    if constant_value(item.v0) is not None and not isinstance(item.v1, ir_ast.Constant):
+        return item.v1, item.v0
+    return None
+
+def ladder(board, i, preds, used_in):
+    # the key and the (constant, target, test slot, JT slot) rungs of the
+    # ladder of tests starting at slot i, and where it goes when no test
+    # holds
+    key = None
+    rungs = []
+    prev = None
+    while i < len(board.slots):
+        item = single_item(board.slots[i])
+        k = compare_key(item)
+        if k is None or (key is not None and k[0].name != key.name):
+            break
+        if prev is not None and preds[i] != [prev]:
+            break
+        j = item.next_ids[0]
+        jt = single_item(board.slots[j]) if j < len(board.slots) else None
+        if not isinstance(jt, ir_ast.JTSlotItem) or jt.cond.name != item.ret.name or preds[j] != [i]:
+            break
+        if not item.ret.is_temporary() or used_in.get(item.ret.name) != set([j]):
+            break
+        key = k[0]
+        rungs.append((k[1], jt.next_ids[0], i, j))
+        prev = j
+        i = jt.next_ids[1]
+    return key, rungs, i
+
+def convert_ladders(board):
+    preds = ir_cfg.predecessors(board)
+    used_in = {}
+    for s in board.slots:
+        for item in s.items:
+            for name in ir_cfg.use_names(item):
+                used_in.setdefault(name, set()).add(s.id)
+    done = set()
+    changed = False
+    for s in board.slots:
+        if s.id in done:
+            continue
+        key, rungs, other = ladder(board, s.id, preds, used_in)
+        if len(rungs) < 2:
+            continue
+        values = []
+        targets = []
+        seen = set()
+        for c, target, test, jt in rungs:
+            if constant_value(c) not in seen: # later equal tests never hold
+                seen.add(constant_value(c))
+                values.append(c)
+                targets.append(target)
+            done.update([test, jt])
+        s.items = [ir_ast.SelectSlotItem(targets + [other], values, key)]
+        changed = True
+    if changed:
+        remove_unreachable(board)
+    return changed
+
+def case_tables(values):
+    # the sorted case positions split where neighbouring values are far apart
+    order = sorted(range(len(values)), key=lambda n: constant_value(values[n]))
+    tables = [[order[0]]]
+    for n in order[1:]:
+        if constant_value(values[n]) - constant_value(values[tables[-1][-1]]) > SELECT_MAX_GAP:
+            tables.append([])
+        tables[-1].append(n)
+    return tables
+
+def split_select(board, item, tag):
+    # entries of a search over the tables of item; the first is the root
+    key = item.key
+    default = item.next_ids[-1]
+    tables = case_tables(item.values)
+    entries = []
+    def node(lo, hi):
+        k = (tag, len(entries))
+        if hi - lo == 1:
+            slot = ir_ast.Slot(None)
+            cases = tables[lo]
+            slot.items.append(ir_ast.SelectSlotItem([item.next_ids[n] for n in cases] + [default], [item.values[n] for n in cases], key))
+            entries.append((k, slot))
+            return k
+        mid = (lo + hi) // 2
+        cond = new_temporary(board, "BOOLEAN")
+        slot = ir_ast.Slot(None)
+        test = ir_ast.BinaryOpSlotItem("LT", [(tag, "jt", mid)], key, item.values[tables[mid][0]], cond)
+        slot.items.append(test)
+        entries.append((k, slot))
+        jt_slot = ir_ast.Slot(None)
+        jt = ir_ast.JTSlotItem(cond)
+        jt_slot.items.append(jt)
+        entries.append(((tag, "jt", mid), jt_slot))
+        jt.next_ids = [node(lo, mid), node(mid, hi)]
+        return k
+    node(0, len(tables))
+    return entries
+
+def split_selects(board):
+    entries = [(s.id, s) for s in board.slots]
+    changed = False
+    for s in board.slots:
+        item = single_item(s)
+        if not isinstance(item, ir_ast.SelectSlotItem) or len(item.values) <= SELECT_MAX_CASES:
+            continue
+        if any([constant_value(v) is None for v in item.values]):
+            continue
+        if len(case_tables(item.values)) < 2:
+            continue
+        new = split_select(board, item, ("select", s.id))
+        s.items = new[0][1].items # the root takes the place of the SELECT
+        entries.extend(new[1:])
+        changed = True
+    if changed:
+        ir_cfg.rebuild(board, entries)
+    return changed
+
+def lower_selects(board):
+    convert_ladders(board)
+    split_selects(board)
+    prune_variables(board)
+    return board
+
+# tree height reduction: a chain of one associative operator, such as
+# ((a + b) + c) + d as it is lowered, is computed as a balanced tree
+# (a + b) + (c + d) in the slots of the chain, so that independent parts
+# can be scheduled together. Integer operators wrap around and stay exact
+# in any order; floating-point ones are only reassociated with fast_math.
+
+ASSOCIATIVE = set(["ADD", "MUL32", "MUL64", "AND", "OR", "XOR"])
+FAST_MATH = set(["FADD32", "FADD64", "FMUL32", "FMUL64"])
+
+def chain_tree(item, inner):
+    # the (operand, consumer) leaves and the height of the chain at item
+    leaves = []
+    height = 0
+    for v in (item.v0, item.v1):
+        sub = inner.get(v.name)
+        if sub is not None and sub.binary_op == item.binary_op and sub.ret.kind == item.ret.kind:
+            l, h = chain_tree(sub, inner)
+            leaves.extend(l)
+            height = max(height, h)
+        else:
+            leaves.append((v, item))
+    return leaves, height + 1
+
+def chain_items(item, inner):
+    items = [item]
+    for v in (item.v0, item.v1):
+        sub = inner.get(v.name)
+        if sub is not None and sub.binary_op == item.binary_op and sub.ret.kind == item.ret.kind:
+            items.extend(chain_items(sub, inner))
+    return items
+
+def chain_region(board, root, items, preds, where):
+    # the items from the first item of the chain to root, when they are on
+    # straight-line slots, otherwise None
+    s = where[id(root)]
+    path = [s]
+    members = set([id(item) for item in items])
+    while True:
+        seen = set([id(item) for p in path for item in p.items])
+        if members <= seen:
+            break
+        if len(preds[s.id]) != 1:
+            return None
+        s = board.slots[preds[s.id][0]]
+        if s.successors() != [path[0].id] or ir_cfg.is_special_slot(s):
+            return None
+        path.insert(0, s)
+    region = [item for p in path for item in p.items]
+    first = min([n for n, item in enumerate(region) if id(item) in members])
+    return region[first:region.index(root) + 1]
+
+def balance_chain(items, leaves, region):
+    # the (item, v0, v1) operands giving a balanced tree, and its height, or
+    # None when the leaves cannot be read earlier than they are
+    members = set([id(item) for item in items])
+    names = set([v.name for v, consumer in leaves])
+    defined = {} # leaf name -> position of its definition in region
+    calls = False
+    for n, item in enumerate(region):
+        if id(item) in members:
+            continue
+        if isinstance(item, (ir_ast.CallSlotItem, ir_ast.JoinSlotItem)):
+            calls = True
+        for name in ir_cfg.def_names(item):
+            if name in names:
+                if name in defined:
+                    return None
+                defined[name] = n
+    position = {}
+    for n, item in enumerate(region):
+        position[id(item)] = n
+    for v, consumer in leaves:
+        if v.name in defined and defined[v.name] > position[id(consumer)]:
+            return None
+        if calls and getattr(v, "member", False):
+            return None
+    # the ready values as (height, order, variable); leaves defined in the
+    # region are ready after their definition
+    pool = []
+    waiting = {}
+    for v, consumer in leaves:
+        if v.name in defined:
+            waiting.setdefault(v.name, []).append(v)
+        else:
+            pool.append((0, len(pool), v))
+    operands = []
+    seq = len(pool)
+    for item in region:
+        if id(item) not in members:
+            for name in ir_cfg.def_names(item):
+                for v in waiting.pop(name, []):
+                    pool.append((0, seq, v))
+                    seq += 1
+            continue
+        if len(pool) < 2:
+            return None
+        pool.sort(key=lambda x: (x[0], x[1]))
+        a = pool.pop(0)
+        b = pool.pop(0)
+        operands.append((item, a[2], b[2]))
+        pool.append((max(a[0], b[0]) + 1, seq, item.ret))
+        seq += 1
+    return operands, pool[0][0]
+
+def balance(board, fast_math=False):
+    # returns the number of chains balanced and their heights before and after
+    ops = set(ASSOCIATIVE)
+    if fast_math:
+        ops |= FAST_MATH
+    defs = {}
+    uses = {}
+    for s in board.slots:
+        for item in s.items:
+            for d in ir_cfg.def_names(item):
+                defs[d] = defs.get(d, 0) + 1
+            for u in ir_cfg.use_names(item):
+                uses[u] = uses.get(u, 0) + 1
+    # temporaries computed by an operator of ops and read once, which can
+    # become inner nodes of the chain reading them
+    inner = {}
+    for s in board.slots:
+        for item in s.items:
+            if isinstance(item, ir_ast.BinaryOpSlotItem) and item.binary_op in ops:
+                name = item.ret.name
+                if item.ret.is_temporary() and defs.get(name) == 1 and uses.get(name) == 1:
+                    inner[name] = item
+    absorbed = set()
+    roots = []
+    for s in board.slots:
+        for item in s.items:
+            if not isinstance(item, ir_ast.BinaryOpSlotItem) or item.binary_op not in ops:
+                continue
+            for v in (item.v0, item.v1):
+                sub = inner.get(v.name)
+                if sub is not None and sub.binary_op == item.binary_op and sub.ret.kind == item.ret.kind:
+                    absorbed.add(v.name)
+            roots.append(item)
+    preds = ir_cfg.predecessors(board)
+    where = {} # id of item -> its slot
+    for s in board.slots:
+        for item in s.items:
+            where[id(item)] = s
+    chains = 0
+    before = 0
+    after = 0
+    for root in roots:
+        if root.ret.name in absorbed:
+            continue
+        leaves, height = chain_tree(root, inner)
+        if len(leaves) < 3:
+            continue
+        items = chain_items(root, inner)
+        region = chain_region(board, root, items, preds, where)
+        if region is None:
+            continue
+        balanced = balance_chain(items, leaves, region)
+        if balanced is None or balanced[1] >= height:
+            continue
+        operands, new_height = balanced
+        for item, v0, v1 in operands:
+            item.v0 = v0
+            item.v1 = v1
+        chains += 1
+        before += height
+        after += new_height
+    return chains, before, after
@@ -0,0 +1,312 @@
+import copy
+
+import ir_ast
+import ir_cfg
+import ir_opt
+import ir_sched
+
+# modulo scheduling of counted loops
+#
+#   cond:  (SET t (LT i n))
+#          (JT t :next (body exit))
+#   body:  straight-line slots, one of which is (SET i (ADD i c)),
+#          jumping back to cond
+#
+# Every operation takes one slot and its result can be read from the
+# next slot on. A new iteration is started every II slots; an operation
+# scheduled at time t belongs to stage t / II of its iteration. The loop
+# is replaced by
+#
+#   guard:    enters the pipeline when at least as many iterations as
+#             stages are left, otherwise the original loop is kept
+#   prologue: stages-1 blocks of II slots, filling the pipeline
+#   kernel:   II slots with every stage, one iteration started per pass
+#   epilogue: stages-1 blocks of II slots, draining the pipeline
+#
+# Items of a kernel slot are ordered by descending stage, so that the
+# slot reads the same values in order as with register semantics.
+
+def single_item(slot):
+    if len(slot.items) == 1:
+        return slot.items[0]
+    return None
+
+def is_jump(item):
+    return isinstance(item, ir_ast.JPSlotItem) or isinstance(item, ir_ast.NopSlotItem)
+
+def counter_step(counter, item, before):
+    # the constant added to counter by item, which is either i++ or
+    # i = t with t = i + c computed earlier in the body
+    if isinstance(item, ir_ast.AssignSlotItem):
+        for prev in reversed(before):
+            if item.rhs.name in ir_cfg.def_names(prev):
+                item = prev
+                break
+        else:
+            return None
+        if counter.name in [v.name for prev in before[before.index(item)+1:] for v in prev.defs()]:
+            return None
+    if not isinstance(item, ir_ast.BinaryOpSlotItem) or item.binary_op != "ADD" or item.v0.name != counter.name:
+        return None
+    step = ir_opt.constant_value(item.v1)
+    if step is None or step <= 0:
+        return None
+    return step
+
+def find_loop(board, jt, preds):
+    # the parts of a counted loop whose condition is jt, or a reason why
+    # it cannot be pipelined
+    jt_slot = None
+    for s in board.slots:
+        if single_item(s) is jt:
+            jt_slot = s
+    if jt_slot is None or len(preds[jt_slot.id]) != 1:
+        return None, "the condition is not a single slot"
+    cond_slot = board.slots[preds[jt_slot.id][0]]
+    cond = single_item(cond_slot)
+    if not (isinstance(cond, ir_ast.BinaryOpSlotItem) and cond.binary_op == "LT" and cond.ret.name == jt.cond.name):
+        return None, "the condition is not i < n"
+    counter = cond.v0
+    bound = cond.v1
+    if isinstance(counter, ir_ast.Constant) or counter.kind not in ir_opt.WIDTHS:
+        return None, "the condition is not i < n"
+
+    body = []
+    ops = []
+    i = jt.next_ids[0]
+    prev = jt_slot.id
+    while i != cond_slot.id:
+        if i >= len(board.slots) or i in body or preds[i] != [prev]:
+            return None, "the body is not straight-line code"
+        s = board.slots[i]
+        if ir_cfg.is_special_slot(s) or len(s.successors()) != 1:
+            return None, "the body is not straight-line code"
+        for item in s.items:
+            if item.is_branch() and not is_jump(item):
+                return None, "the body is not straight-line code"
+            if not is_jump(item):
+                ops.append(item)
+        body.append(i)
+        prev = i
+        i = s.successors()[0]
+
+    step = None
+    for n, item in enumerate(ops):
+        if counter.name in ir_cfg.def_names(item):
+            if step is not None:
+                return None, "the counter is not incremented once by a constant"
+            step = counter_step(counter, item, ops[:n])
+            if step is None:
+                return None, "the counter is not incremented once by a constant"
+        if bound.name in ir_cfg.def_names(item):
+            return None, "the bound is written in the loop"
+    if step is None:
+        return None, "the counter is not incremented once by a constant"
+    return {"jt": jt, "jt_slot": jt_slot, "cond_slot": cond_slot, "counter": counter,
+            "bound": bound, "step": step, "body": body, "ops": ops}, None
+
+def dependences(ops):
+    # (src, dst, latency, distance): dst of an iteration distance later
+    # starts at least latency slots after src
+    edges = []
+    uses = [set(ir_cfg.use_names(item)) for item in ops]
+    defs = [set(ir_cfg.def_names(item)) for item in ops]
+    for a in range(len(ops)):
+        for b in range(a, len(ops)):
+            if a < b:
+                if defs[a] & uses[b]:
+                    edges.append((a, b, 1, 0))
+                if uses[a] & defs[b]:
+                    edges.append((a, b, 0, 0))
+                if defs[a] & defs[b]:
+                    edges.append((a, b, 1, 0))
+                    edges.append((b, a, 1, 1))
+            if defs[b] & uses[a]:
+                edges.append((b, a, 1, 1))
+            if uses[b] & defs[a]:
+                edges.append((b, a, 0, 1))
+    return edges
+
+def modulo_schedule(ops, edges, ii, resources):
+    into = [[] for item in ops]
+    for e in edges:
+        if e[3] == 0:
+            into[e[1]].append(e)
+    times = []
+    usage = {}
+    for o, item in enumerate(ops):
+        t = 0
+        for a, b, latency, distance in into[o]:
+            t = max(t, times[a] + latency)
+        kind, res = ir_sched.item_resource(item)
+        limit = resources.get(kind)
+        for tt in range(t, t + ii):
+            if limit is None or usage.get((tt % ii, res), 0) < limit:
+                break
+        else:
+            return None
+        if limit is not None:
+            usage[(tt % ii, res)] = usage.get((tt % ii, res), 0) + 1
+        times.append(tt)
+    for a, b, latency, distance in edges:
+        if times[b] < times[a] + latency - distance * ii:
+            return None
+    return times
+
+def initiation_interval(ops, edges, min_ii, max_ii, resources):
+    counts = {}
+    for item in ops:
+        kind, res = ir_sched.item_resource(item)
+        if kind in resources:
+            counts[res] = (kind, counts.get(res, (kind, 0))[1] + 1)
+    for res, (kind, n) in counts.items():
+        min_ii = max(min_ii, (n + resources[kind] - 1) // resources[kind])
+    for ii in range(min_ii, max_ii):
+        times = modulo_schedule(ops, edges, ii, resources)
+        if times is not None:
+            return ii, times
+    return None, None
+
+def stage_slots(loop, times, ii, stages):
+    # the items of each kernel slot as (stage, position, item)
+    kernel = [[] for k in range(ii)]
+    for o, item in enumerate(loop["ops"]):
+        kernel[times[o] % ii].append((times[o] // ii, o, item))
+    for entries in kernel:
+        entries.sort(key=lambda e: (-e[0], e[1]))
+    return kernel
+
+def emit_block(entries, keep, key, next_key):
+    slot = ir_ast.Slot(None)
+    for stage, o, item in entries:
+        if keep(stage):
+            item = copy.copy(item)
+            item.next_ids = [next_key]
+            slot.items.append(item)
+    if len(slot.items) == 0:
+        slot.items.append(ir_ast.NopSlotItem(next_key))
+    return (key, slot)
+
+def pipeline_loop(board, loop, ii, times, tag):
+    counter = loop["counter"]
+    bound = loop["bound"]
+    step = loop["step"]
+    kind = counter.kind
+    exit_id = loop["jt"].next_ids[1]
+    stages = max(times) // ii + 1
+    kernel = stage_slots(loop, times, ii, stages)
+
+    def key(name, *args):
+        return (tag, name) + args
+
+    first = ir_opt.new_temporary(board, kind)
+    cond = ir_opt.new_temporary(board, "BOOLEAN")
+    start = ir_opt.new_temporary(board, kind)
+    more = ir_opt.new_temporary(board, "BOOLEAN")
+    entries = []
+
+    # guard: i + (stages-1)*step < n, and the counter of the next pass
+    slot = ir_ast.Slot(None)
+    item = ir_ast.BinaryOpSlotItem("ADD", [key("guard", 1)], counter, board.constant(kind, (stages - 1) * step), first)
+    slot.items.append(item)
+    item = ir_ast.BinaryOpSlotItem("ADD", [key("guard", 1)], counter, board.constant(kind, stages * step), start)
+    slot.items.append(item)
+    entries.append((key("guard", 0), slot))
+    slot = ir_ast.Slot(None)
+    slot.items.append(ir_ast.BinaryOpSlotItem("LT", [key("guard", 2)], first, bound, cond))
+    entries.append((key("guard", 1), slot))
+    def stage_key(j, k):
+        # slot k of prologue block j (j < stages-1) or epilogue block j
+        if j < stages - 1:
+            return key("stage", j, k)
+        elif j == stages - 1:
+            return key("kernel", k)
+        else:
+            return key("stage", j, k)
+
+    def block_next(j, k):
+        if k + 1 < ii:
+            return stage_key(j, k + 1)
+        elif j + 1 < 2 * stages - 1:
+            return stage_key(j + 1, 0)
+        return exit_id
+
+    slot = ir_ast.Slot(None)
+    jt = ir_ast.JTSlotItem(cond)
+    jt.next_ids = [stage_key(0, 0), loop["cond_slot"].id]
+    slot.items.append(jt)
+    entries.append((key("guard", 2), slot))
+
+    for j in range(stages - 1):
+        for k in range(ii):
+            entries.append(emit_block(kernel[k], lambda s: s <= j, stage_key(j, k), block_next(j, k)))
+
+    # kernel: the pass continues while the iteration after the one it
+    # started is in range
+    epilogue = stage_key(stages, 0) if stages > 1 else exit_id
+    for k in range(ii):
+        if k + 1 < ii:
+            next_key = key("kernel", k + 1)
+        else:
+            next_key = key("kernel", "jt")
+        key_, slot = emit_block(kernel[k], lambda s: True, key("kernel", k), next_key)
+        if k == 0:
+            slot.items = [item for item in slot.items if not is_jump(item)]
+            slot.items.insert(0, ir_ast.BinaryOpSlotItem("LT", [next_key], start, bound, more))
+            slot.items.append(ir_ast.BinaryOpSlotItem("ADD", [next_key], start, board.constant(kind, step), start))
+        if k + 1 == ii:
+            slot.items = [item for item in slot.items if not is_jump(item)]
+            jt = ir_ast.JTSlotItem(more)
+            jt.next_ids = [key("kernel", 0), epilogue]
+            slot.items.append(jt)
+            for item in slot.items[:-1]:
+                item.next_ids = [key("kernel", 0)]
+        entries.append((key_, slot))
+
+    for j in range(stages, 2 * stages - 1):
+        first_stage = j - stages + 1
+        for k in range(ii):
+            entries.append(emit_block(kernel[k], lambda s: s >= first_stage, stage_key(j, k), block_next(j, k)))
+    return entries, stages
+
+def pipeline(board, loops=None, chain_budget=0, resources=None):
+    # pipelines the loops whose JT items are given, or every counted loop
+    # when loops is None. Returns (jt, II, stages) for every pipelined loop
+    # and (jt, None, reason) for the given loops left as they are.
+    if resources is None:
+        resources = ir_sched.RESOURCES
+    quiet = loops is None
+    if loops is None:
+        loops = [s.items[-1] for s in board.slots if isinstance(single_item(s), ir_ast.JTSlotItem)]
+    # a kernel of one slot reads the condition it computes in that slot
+    min_ii = 1 if chain_budget >= ir_sched.DELAYS["LT"] else 2
+    report = []
+    entries = [(s.id, s) for s in board.slots]
+    redirect = []
+    for n, jt in enumerate(loops):
+        preds = ir_cfg.predecessors(board)
+        loop, reason = find_loop(board, jt, preds)
+        if loop is None:
+            if not quiet:
+                report.append((jt, None, reason))
+            continue
+        ops = loop["ops"]
+        # one iteration takes a slot per operation and two for the condition
+        ii, times = initiation_interval(ops, dependences(ops), min_ii, len(ops) + 2, resources)
+        if ii is None:
+            if not quiet:
+                report.append((jt, None, "no initiation interval is shorter than an iteration"))
+            continue
+        new, stages = pipeline_loop(board, loop, ii, times, "pipeline_{}".format(n))
+        entries.extend(new)
+        cond_id = loop["cond_slot"].id
+        for p in preds[cond_id]:
+            if p != loop["body"][-1]:
+                redirect.append((p, cond_id, new[0][0]))
+        report.append((jt, ii, stages))
+    for p, old, new in redirect:
+        for item in board.slots[p].items:
+            item.next_ids = [new if i == old else i for i in item.next_ids]
+    if len(redirect) > 0:
+        ir_cfg.rebuild(board, entries)
+    return report
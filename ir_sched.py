@@ -0,0 +1,208 @@
+import json
+
+import ir_ast
+import ir_cfg
+
+# combinational delay of single-cycle operators in abstract units.
+# Operators which are not listed are multi-cycle and are never chained.
+DELAYS = {
+    "ASSIGN": 0,
+    "ADD": 2,
+    "SUB": 2,
+    "LT": 2,
+    "GT": 2,
+    "COMPEQ": 1,
+    "JT": 0,
+    "JP": 0,
+    "RETURN": 0,
+    "SELECT": 1,
+    "COND": 1,
+    "AND": 1,
+    "OR": 1,
+    "XOR": 1,
+    "SIMPLE_LSHIFT32": 0,
+    "SIMPLE_LSHIFT64": 0,
+    "SIMPLE_ARITH_RSHIFT32": 0,
+    "SIMPLE_ARITH_RSHIFT64": 0,
+}
+
+# estimated cycles taken by multi-cycle operators
+LATENCIES = {
+    "MUL32": 3,
+    "MUL64": 5,
+    "DIV32": 36,
+    "DIV64": 68,
+    "MOD32": 36,
+    "MOD64": 68,
+    "FADD32": 8,
+    "FSUB32": 8,
+    "FMUL32": 8,
+    "FDIV32": 28,
+    "FADD64": 12,
+    "FSUB64": 12,
+    "FMUL64": 12,
+    "FDIV64": 56,
+    "ARRAY_ACCESS": 2,
+    "ARRAY_INDEX": 1,
+}
+
+# how many instances of an operator may be started in the same slot
+RESOURCES = {}
+for op in LATENCIES:
+    if op != "ARRAY_ACCESS" and op != "ARRAY_INDEX":
+        RESOURCES[op] = 1
+# ports of a memory; every access of an array takes one in its slot
+RESOURCES["MEMORY"] = 1
+
+def make_resources(ram_ports=1):
+    resources = dict(RESOURCES)
+    resources["MEMORY"] = ram_ports
+    return resources
+
+def item_resource(item):
+    # the entry of the resource table limiting item, and what is counted
+    # against it
+    if isinstance(item, (ir_ast.ArrayReadSlotItem, ir_ast.ArrayWriteSlotItem)):
+        return "MEMORY", ("MEMORY", item.array.name)
+    op = item_op(item)
+    return op, op
+
+def item_op(item):
+    if isinstance(item, ir_ast.BinaryOpSlotItem):
+        return item.binary_op
+    elif isinstance(item, ir_ast.AssignSlotItem):
+        return "ASSIGN"
+    elif isinstance(item, ir_ast.CondSlotItem):
+        return "COND"
+    elif isinstance(item, ir_ast.CallSlotItem):
+        return "CALL"
+    elif isinstance(item, ir_ast.JoinSlotItem):
+        return "JOIN"
+    elif isinstance(item, ir_ast.ArrayReadSlotItem):
+        return "ARRAY_ACCESS"
+    elif isinstance(item, ir_ast.ArrayWriteSlotItem):
+        return "ARRAY_INDEX"
+    else:
+        return item.op
+
+def load_delay_model(path):
+    f = open(path)
+    model = json.load(f)
+    f.close()
+    delays = dict(DELAYS)
+    delays.update(model)
+    return delays
+
+class Scheduler:
+
+    def __init__(self, delays=None, chain_budget=0, resources=None):
+        if delays is None:
+            delays = DELAYS
+        if resources is None:
+            resources = RESOURCES
+        self.delays = delays
+        self.chain_budget = chain_budget
+        self.resources = resources
+
+    def chainable(self, producer, consumer):
+        if self.chain_budget <= 0:
+            return False
+        return item_op(producer) in self.delays and item_op(consumer) in self.delays
+
+    def schedule_block(self, items):
+        # returns a slot index for each item, in the order of items
+        step = []
+        arrival = []
+        usage = []
+        last = 0
+        last_def = {} # variable -> index of the latest item writing it
+        last_use = {} # variable -> latest slot index reading it
+        for i, item in enumerate(items):
+            uses = ir_cfg.use_names(item)
+            defs = ir_cfg.def_names(item)
+            earliest = 0
+            raw = []
+            for u in uses:
+                j = last_def.get(u)
+                if j is None:
+                    continue
+                raw.append(j)
+                if self.chainable(items[j], item):
+                    earliest = max(earliest, step[j])
+                else:
+                    earliest = max(earliest, step[j]+1)
+            for d in defs:
+                j = last_def.get(d)
+                if j is not None:
+                    earliest = max(earliest, step[j]+1)
+                earliest = max(earliest, last_use.get(d, 0))
+            if item.is_branch():
+                earliest = max(earliest, last)
+            op = item_op(item)
+            kind, res = item_resource(item)
+            limit = self.resources.get(kind)
+            t = earliest
+            while True:
+                arr = self.delays.get(op, 0)
+                chained = False
+                for j in raw:
+                    if step[j] == t:
+                        chained = True
+                        arr = max(arr, arrival[j] + self.delays.get(op, 0))
+                if chained and arr > self.chain_budget:
+                    t += 1
+                    continue
+                while len(usage) <= t:
+                    usage.append({})
+                if limit is not None and usage[t].get(res, 0) >= limit:
+                    t += 1
+                    continue
+                break
+            usage[t][res] = usage[t].get(res, 0) + 1
+            step.append(t)
+            arrival.append(arr)
+            last = max(last, t)
+            for u in uses:
+                last_use[u] = max(last_use.get(u, 0), t)
+            for d in defs:
+                last_def[d] = i
+        return step
+
+    def schedule(self, board):
+        entries = []
+        for block in ir_cfg.basic_blocks(board):
+            first = board.slots[block[0]]
+            if ir_cfg.is_special_slot(first) or len(first.items) == 0:
+                entries.append((first.id, first))
+                continue
+            items = []
+            for i in block:
+                items.extend(board.slots[i].items)
+            tail = board.slots[block[-1]]
+            exits = list(tail.successors())
+            # plain jumps only carry the next id, which is kept in exits
+            ops = [item for item in items if not isinstance(item, (ir_ast.NopSlotItem, ir_ast.JPSlotItem))]
+            if len(ops) > 0:
+                items = ops
+            else:
+                items = items[-1:]
+            step = self.schedule_block(items)
+            n = max(step) + 1
+            slots = [ir_ast.Slot(0) for k in range(n)]
+            for item, t in zip(items, step):
+                slots[t].items.append(item)
+            keys = [first.id] + [(first.id, k) for k in range(1, len(slots))]
+            for k, s in enumerate(slots):
+                if k < len(slots) - 1:
+                    targets = [keys[k+1]]
+                else:
+                    targets = exits
+                for item in s.items:
+                    if not item.is_branch():
+                        item.next_ids = list(targets[:1])
+                entries.append((keys[k], s))
+        ir_cfg.rebuild(board, entries)
+        return board
+
+def schedule(board, delays=None, chain_budget=0, resources=None):
+    return Scheduler(delays, chain_budget, resources).schedule(board)
@@ -0,0 +1,628 @@
+import copy
+import json
+import random
+import re
+from optparse import OptionParser
+
+import ir_ast
+import ir_opt
+import ir_sched
+
+try:
+    import numpy
+except ImportError:
+    numpy = None # run_batch falls back to one vector at a time
+
+# a cycle counting interpreter of boards, for ir_ast.Module objects and
+# for .ir files.
+#
+# A slot takes one cycle, or the latency of its slowest multi-cycle
+# operator. A call takes one cycle more than the callee, which runs from
+# METHOD_ENTRY up to its RETURN or its jump back to METHOD_EXIT. A call
+# made with :no_wait is run when it is joined, as every slot depending on
+# it comes after the join; the join waits for what is left of the call.
+# Integer division by zero gives 0.
+
+class SimulationError(Exception):
+    pass
+
+def kind_dtype(kind):
+    if kind == "BOOLEAN":
+        return bool
+    elif kind == "FLOAT" or kind == "DOUBLE":
+        return numpy.float64
+    return numpy.int64
+
+def is_lanes(x):
+    return numpy is not None and isinstance(x, numpy.ndarray)
+
+def wrap(x, kind):
+    # the value x converted to kind as by C assignment
+    if kind not in ir_opt.WIDTHS:
+        return x
+    if is_lanes(x):
+        x = x.astype(numpy.int64)
+        w = ir_opt.WIDTHS[kind]
+        if w < 64:
+            half = 1 << (w - 1)
+            x = ((x + half) & ((1 << w) - 1)) - half
+        return x
+    return ir_opt.wrap(int(x), kind)
+
+def divide(a, b):
+    if is_lanes(a) or is_lanes(b):
+        a = numpy.asarray(a)
+        b = numpy.asarray(b)
+        q = numpy.abs(a) // numpy.where(b == 0, 1, numpy.abs(b))
+        q = numpy.where((a < 0) != (b < 0), -q, q)
+        return numpy.where(b == 0, 0, q)
+    if b == 0:
+        return 0
+    return ir_opt.c_div(a, b)
+
+def fdivide(a, b):
+    if is_lanes(a) or is_lanes(b):
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            return numpy.true_divide(a, b)
+    if b == 0:
+        return float("nan") if a == 0 else float("inf") * (1 if a > 0 else -1)
+    return a / b
+
+def binop(op, a, b, kind):
+    base = op.rstrip("0123456789")
+    if base == "ADD" or base == "FADD":
+        return a + b
+    elif base == "SUB" or base == "FSUB":
+        return a - b
+    elif base == "MUL" or base == "FMUL":
+        return a * b
+    elif base == "DIV":
+        return divide(a, b)
+    elif base == "FDIV":
+        return fdivide(a, b)
+    elif base == "MOD":
+        return a - divide(a, b) * b
+    elif base == "LT":
+        return a < b
+    elif base == "GT":
+        return a > b
+    elif base == "LEQ":
+        return a <= b
+    elif base == "GEQ":
+        return a >= b
+    elif base == "COMPEQ":
+        return a == b
+    elif base == "NEQ":
+        return a != b
+    elif base == "AND":
+        return a & b
+    elif base == "OR":
+        return a | b
+    elif base == "XOR":
+        return a ^ b
+    elif base == "LAND":
+        return (a != 0) & (b != 0)
+    elif base == "LOR":
+        return (a != 0) | (b != 0)
+    elif base == "SIMPLE_LSHIFT":
+        return a << b
+    elif base == "SIMPLE_ARITH_RSHIFT":
+        return a >> b
+    elif base == "SIMPLE_LOGIC_RSHIFT":
+        return (a & ((1 << ir_opt.WIDTHS.get(kind, 64)) - 1)) >> b
+    raise SimulationError("unknown operator {}".format(op))
+
+def constant(c):
+    if c.kind == "BOOLEAN":
+        return str(c.value) == "true"
+    elif c.kind == "FLOAT" or c.kind == "DOUBLE":
+        return float(str(c.value).rstrip("fFlL"))
+    value = ir_opt.constant_value(c)
+    if value is None:
+        s = str(c.value)
+        if len(s) == 3 and s[0] == "'":
+            return ord(s[1])
+        raise SimulationError("cannot read constant {} {}".format(c.name, c.value))
+    return wrap(value, c.kind)
+
+def slot_costs(board):
+    # cycles of each slot without its calls and joins
+    costs = []
+    for s in board.slots:
+        cycles = 1
+        for item in s.items:
+            if not isinstance(item, (ir_ast.CallSlotItem, ir_ast.JoinSlotItem)):
+                cycles = max(cycles, ir_sched.LATENCIES.get(ir_sched.item_op(item), 1))
+        costs.append(cycles)
+    return costs
+
+def parameters(board):
+    return [v for v in board.variables if isinstance(v, ir_ast.Variable) and v.method_param]
+
+class Simulator:
+
+    def __init__(self, boards, variables=(), max_cycles=10**7):
+        self.boards = {}
+        for board in boards:
+            self.boards[board.name] = board
+        self.max_cycles = max_cycles
+        self.members = {} # values of the globals, zero until written
+        for v in variables:
+            if isinstance(v, ir_ast.Variable):
+                self.members[v.name] = self.initial(v)
+        self.visits = {} # board name -> {slot id: times entered}
+        self.spent = {} # board name -> {slot id: cycles}, calls not included
+        self.calls = [] # (board name, cycles) of every finished call
+        self.constants = {}
+        self.costs = {}
+
+    def initial(self, v):
+        zero = False if v.kind == "BOOLEAN" else 0
+        if isinstance(v, ir_ast.ArrayVariable):
+            return [zero] * v.length
+        return zero
+
+    def constant(self, c):
+        if c.name not in self.constants:
+            self.constants[c.name] = constant(c)
+        return self.constants[c.name]
+
+    def board(self, name):
+        board = self.boards.get(name)
+        if board is None:
+            raise SimulationError("no board {}".format(name))
+        if name not in self.costs:
+            self.costs[name] = slot_costs(board)
+        return board
+
+    def store(self, env, v):
+        if v.member:
+            if v.name not in self.members:
+                self.members[v.name] = self.initial(v)
+            return self.members
+        if v.name not in env:
+            env[v.name] = self.initial(v)
+        return env
+
+    def get(self, env, v):
+        if isinstance(v, ir_ast.Constant):
+            return self.constant(v)
+        return self.store(env, v)[v.name]
+
+    def set(self, env, v, x):
+        self.store(env, v)[v.name] = wrap(x, v.kind)
+
+    def element(self, env, item):
+        array = self.get(env, item.array)
+        i = self.get(env, item.index)
+        if i < 0 or i >= len(array):
+            raise SimulationError("index {} out of {}".format(i, item.array.name))
+        return array, i
+
+    def call(self, name, args):
+        # runs board name with args; returns its value (None for VOID
+        # boards) and the cycles it took
+        board = self.board(name)
+        costs = self.costs[name]
+        params = parameters(board)
+        if len(args) != len(params):
+            raise SimulationError("{} takes {} arguments".format(name, len(params)))
+        env = {}
+        for p, a in zip(params, args):
+            env[p.name] = wrap(a, p.kind)
+        visits = self.visits.setdefault(name, {})
+        spent = self.spent.setdefault(name, {})
+        pending = {}
+        ret = None
+        t = 0
+        cur = 1
+        while cur != 0:
+            slot = board.slots[cur]
+            visits[cur] = visits.get(cur, 0) + 1
+            spent[cur] = spent.get(cur, 0) + costs[cur]
+            cost = costs[cur]
+            nxt = slot.successors()[0]
+            done = False
+            for item in slot.items:
+                if isinstance(item, ir_ast.BinaryOpSlotItem):
+                    self.set(env, item.ret, binop(item.binary_op, self.get(env, item.v0), self.get(env, item.v1), item.ret.kind))
+                elif isinstance(item, ir_ast.AssignSlotItem):
+                    self.set(env, item.lhs, self.get(env, item.rhs))
+                elif isinstance(item, ir_ast.CondSlotItem):
+                    v = item.v0 if self.get(env, item.cond) else item.v1
+                    self.set(env, item.ret, self.get(env, v))
+                elif isinstance(item, ir_ast.ArrayReadSlotItem):
+                    array, i = self.element(env, item)
+                    self.set(env, item.ret, array[i])
+                elif isinstance(item, ir_ast.ArrayWriteSlotItem):
+                    array, i = self.element(env, item)
+                    array[i] = wrap(self.get(env, item.value), item.array.kind)
+                elif isinstance(item, ir_ast.CallSlotItem) and item.no_wait:
+                    pending[item.name] = ([self.get(env, a) for a in item.args], t)
+                elif isinstance(item, ir_ast.CallSlotItem):
+                    value, cycles = self.call(item.name, [self.get(env, a) for a in item.args])
+                    if value is not None:
+                        self.set(env, item.ret, value)
+                    cost = max(cost, 1 + cycles)
+                elif isinstance(item, ir_ast.JoinSlotItem):
+                    call_args, start = pending.pop(item.name)
+                    value, cycles = self.call(item.name, call_args)
+                    if value is not None:
+                        self.set(env, item.ret, value)
+                    cost = max(cost, start + 1 + cycles - t)
+                elif isinstance(item, ir_ast.ReturnSlotItem):
+                    if board.kind != "VOID":
+                        ret = wrap(self.get(env, item.v), board.kind)
+                    done = True
+                elif isinstance(item, ir_ast.JTSlotItem):
+                    nxt = item.next_ids[0] if self.get(env, item.cond) else item.next_ids[1]
+                elif isinstance(item, ir_ast.SelectSlotItem):
+                    key = self.get(env, item.key)
+                    nxt = item.next_ids[-1]
+                    for i, v in enumerate(item.values):
+                        if self.get(env, v) == key:
+                            nxt = item.next_ids[i]
+                            break
+            t += cost
+            if t > self.max_cycles:
+                raise SimulationError("{} did not return within {} cycles".format(name, self.max_cycles))
+            if done:
+                break
+            cur = nxt
+        self.calls.append((name, t))
+        return ret, t
+
+    def run_batch(self, name, vectors):
+        # runs board name once per argument vector, every run starting from
+        # the current globals. Returns the values, the cycles and the
+        # globals at the end, with one entry per vector.
+        if numpy is None or len(vectors) == 0:
+            return self.run_each(name, vectors)
+        board = self.board(name)
+        n = len(vectors)
+        args = []
+        for k, p in enumerate(parameters(board)):
+            args.append(numpy.array([row[k] for row in vectors], dtype=kind_dtype(p.kind)))
+        lanes = LaneState(self, n)
+        values, cycles = lanes.call(name, numpy.arange(n), args)
+        members = {}
+        for key, x in self.members.items():
+            members[key] = lanes.member(key, x)
+        for key, x in lanes.members.items():
+            members[key] = x
+        return values, cycles, members
+
+    def run_each(self, name, vectors):
+        values = []
+        cycles = []
+        members = {}
+        start = self.members
+        for args in vectors:
+            self.members = copy.deepcopy(start)
+            value, t = self.call(name, args)
+            values.append(value)
+            cycles.append(t)
+            for key, x in self.members.items():
+                members.setdefault(key, []).append(x)
+        self.members = start
+        return values, cycles, members
+
+class LaneState:
+
+    # the batched run of Simulator.run_batch: every variable holds one
+    # value per lane. Lanes at the same slot are stepped together.
+    def __init__(self, sim, n):
+        self.sim = sim
+        self.n = n
+        self.members = {}
+
+    def member(self, name, initial):
+        if name not in self.members:
+            x = numpy.array(initial)
+            self.members[name] = numpy.repeat(x[numpy.newaxis, ...], self.n, axis=0)
+        return self.members[name]
+
+    def variable(self, env, v, lanes, m):
+        # the array holding v, and the rows of it selected by lanes (global
+        # lane numbers) or by positions in env
+        if v.member:
+            return self.member(v.name, self.sim.members.get(v.name, self.sim.initial(v))), lanes
+        if v.name not in env:
+            shape = (m, v.length) if isinstance(v, ir_ast.ArrayVariable) else (m,)
+            env[v.name] = numpy.zeros(shape, dtype=kind_dtype(v.kind))
+        return env[v.name], None
+
+    def get(self, env, v, lanes, sel, m):
+        if isinstance(v, ir_ast.Constant):
+            return self.sim.constant(v)
+        x, rows = self.variable(env, v, lanes, m)
+        return x[rows[sel] if rows is not None else sel]
+
+    def set(self, env, v, x, lanes, sel, m):
+        a, rows = self.variable(env, v, lanes, m)
+        a[rows[sel] if rows is not None else sel] = wrap(x, v.kind)
+
+    def element(self, env, item, lanes, sel, m):
+        a, rows = self.variable(env, item.array, lanes, m)
+        i = numpy.broadcast_to(self.get(env, item.index, lanes, sel, m), sel.shape)
+        if (i < 0).any() or (i >= item.array.length).any():
+            raise SimulationError("index out of {}".format(item.array.name))
+        return a, (rows[sel] if rows is not None else sel), i
+
+    def call(self, name, lanes, args):
+        sim = self.sim
+        board = sim.board(name)
+        costs = sim.costs[name]
+        m = len(lanes)
+        env = {}
+        for p, a in zip(parameters(board), args):
+            env[p.name] = numpy.array(numpy.broadcast_to(wrap(a, p.kind), (m,)), dtype=kind_dtype(p.kind))
+        visits = sim.visits.setdefault(name, {})
+        spent = sim.spent.setdefault(name, {})
+        pending = {}
+        ret = None
+        if board.kind != "VOID":
+            ret = numpy.zeros(m, dtype=kind_dtype(board.kind))
+        t = numpy.zeros(m, dtype=numpy.int64)
+        cur = numpy.ones(m, dtype=numpy.int64)
+        active = numpy.ones(m, dtype=bool)
+        while active.any():
+            for s in numpy.unique(cur[active]):
+                sel = numpy.nonzero(active & (cur == s))[0]
+                if len(sel) == 0:
+                    continue
+                slot = board.slots[s]
+                visits[int(s)] = visits.get(int(s), 0) + len(sel)
+                spent[int(s)] = spent.get(int(s), 0) + len(sel) * costs[s]
+                cost = numpy.full(len(sel), costs[s], dtype=numpy.int64)
+                nxt = numpy.full(len(sel), slot.successors()[0], dtype=numpy.int64)
+                done = False
+                for item in slot.items:
+                    def get(v):
+                        return self.get(env, v, lanes, sel, m)
+                    def put(v, x):
+                        self.set(env, v, x, lanes, sel, m)
+                    if isinstance(item, ir_ast.BinaryOpSlotItem):
+                        with numpy.errstate(all="ignore"):
+                            put(item.ret, binop(item.binary_op, get(item.v0), get(item.v1), item.ret.kind))
+                    elif isinstance(item, ir_ast.AssignSlotItem):
+                        put(item.lhs, get(item.rhs))
+                    elif isinstance(item, ir_ast.CondSlotItem):
+                        put(item.ret, numpy.where(get(item.cond), get(item.v0), get(item.v1)))
+                    elif isinstance(item, ir_ast.ArrayReadSlotItem):
+                        a, rows, i = self.element(env, item, lanes, sel, m)
+                        put(item.ret, a[rows, i])
+                    elif isinstance(item, ir_ast.ArrayWriteSlotItem):
+                        a, rows, i = self.element(env, item, lanes, sel, m)
+                        a[rows, i] = wrap(get(item.value), item.array.kind)
+                    elif isinstance(item, ir_ast.CallSlotItem) and item.no_wait:
+                        if item.name not in pending:
+                            pending[item.name] = ([numpy.zeros(m, dtype=kind_dtype(a.kind)) for a in item.args], numpy.zeros(m, dtype=numpy.int64))
+                        call_args, start = pending[item.name]
+                        for x, a in zip(call_args, item.args):
+                            x[sel] = get(a)
+                        start[sel] = t[sel]
+                    elif isinstance(item, ir_ast.CallSlotItem):
+                        value, cycles = self.call(item.name, lanes[sel], [get(a) for a in item.args])
+                        if value is not None:
+                            put(item.ret, value)
+                        cost = numpy.maximum(cost, 1 + cycles)
+                    elif isinstance(item, ir_ast.JoinSlotItem):
+                        call_args, start = pending[item.name]
+                        value, cycles = self.call(item.name, lanes[sel], [x[sel] for x in call_args])
+                        if value is not None:
+                            put(item.ret, value)
+                        cost = numpy.maximum(cost, start[sel] + 1 + cycles - t[sel])
+                    elif isinstance(item, ir_ast.ReturnSlotItem):
+                        if ret is not None:
+                            ret[sel] = wrap(get(item.v), board.kind)
+                        done = True
+                    elif isinstance(item, ir_ast.JTSlotItem):
+                        nxt = numpy.where(get(item.cond), item.next_ids[0], item.next_ids[1])
+                    elif isinstance(item, ir_ast.SelectSlotItem):
+                        key = get(item.key)
+                        nxt = numpy.full(len(sel), item.next_ids[-1], dtype=numpy.int64)
+                        for i in reversed(range(len(item.values))):
+                            nxt = numpy.where(key == get(item.values[i]), item.next_ids[i], nxt)
+                t[sel] += cost
+                if (t[sel] > sim.max_cycles).any():
+                    raise SimulationError("{} did not return within {} cycles".format(name, sim.max_cycles))
+                cur[sel] = nxt
+                if done:
+                    active[sel] = False
+                else:
+                    active[sel] = nxt != 0
+        for c in t:
+            sim.calls.append((name, int(c)))
+        return ret, t
+
+def write_profile(sim, path):
+    # the slot profile read by c2ir.py --profile
+    boards = {}
+    for name, visits in sim.visits.items():
+        boards[name] = {"slots": len(sim.boards[name].slots), "visits": visits, "cycles": sim.spent.get(name, {})}
+    f = open(path, "w")
+    json.dump({"boards": boards}, f, indent=1, sort_keys=True)
+    f.close()
+
+# reading .ir files
+
+def tokenize(text):
+    return re.findall(r"\(|\)|[^\s()]+", text)
+
+def read_sexp(tokens):
+    stack = [[]]
+    for tok in tokens:
+        if tok == "(":
+            stack.append([])
+        elif tok == ")":
+            x = stack.pop()
+            stack[-1].append(x)
+        else:
+            stack[-1].append(tok)
+    if len(stack) != 1:
+        raise SimulationError("unbalanced parentheses")
+    return stack[0]
+
+def keywords(x):
+    # the :key value pairs of the list x
+    d = {}
+    for i in range(len(x) - 1):
+        if isinstance(x[i], str) and x[i].startswith(":"):
+            d[x[i]] = x[i + 1]
+    return d
+
+def read_variable(x):
+    if x[0] == "CONSTANT":
+        return ir_ast.Constant(x[2], x[1], x[3])
+    k = keywords(x)
+    flags = {}
+    for name in ("public", "global_constant", "method_param", "private_method", "volatile", "member"):
+        flags[name] = k.get(":" + name) == "true"
+    if isinstance(x[1], list):
+        return ir_ast.ArrayVariable(x[2], x[1][1], int(x[1][2]), original=k.get(":original"), method=k.get(":method"), **flags)
+    return ir_ast.Variable(x[2], x[1], original=k.get(":original"), method=k.get(":method"), **flags)
+
+def read_item(x, table):
+    def var(name):
+        if name not in table:
+            raise SimulationError("unknown variable {}".format(name))
+        return table[name]
+    next_ids = [int(i) for i in keywords(x).get(":next", [])]
+    op = x[0]
+    if op == "SET" and isinstance(x[1], list):
+        # (SET (ARRAY_INDEX a i) (ASSIGN v))
+        return ir_ast.ArrayWriteSlotItem(next_ids, var(x[1][1]), var(x[1][2]), var(x[2][1]))
+    elif op == "SET":
+        ret = var(x[1])
+        e = x[2]
+        if e[0] == "ASSIGN":
+            item = ir_ast.AssignSlotItem(ret, var(e[1]))
+            item.next_ids = next_ids
+            return item
+        elif e[0] == "COND":
+            return ir_ast.CondSlotItem(next_ids, var(e[1]), var(e[2]), var(e[3]), ret)
+        elif e[0] == "CALL":
+            k = keywords(e)
+            return ir_ast.CallSlotItem(next_ids, k[":name"], [var(a) for a in k[":args"]], ret, k[":no_wait"] == "true")
+        elif e[0] == "JOIN":
+            return ir_ast.JoinSlotItem(next_ids, keywords(e)[":name"], ret)
+        elif e[0] == "ARRAY_ACCESS":
+            return ir_ast.ArrayReadSlotItem(next_ids, var(e[1]), var(e[2]), ret)
+        return ir_ast.BinaryOpSlotItem(e[0], next_ids, var(e[1]), var(e[2]), ret)
+    elif op == "RETURN":
+        item = ir_ast.ReturnSlotItem(var(x[1]))
+    elif op == "JT":
+        item = ir_ast.JTSlotItem(var(x[1]))
+    elif op == "JP":
+        item = ir_ast.JPSlotItem(0)
+    elif op == "SELECT":
+        item = ir_ast.SelectSlotItem(next_ids, [var(v) for v in keywords(x)[":patterns"]], var(x[1]))
+    else:
+        item = ir_ast.SlotItem(op, next_ids)
+    item.next_ids = next_ids
+    return item
+
+def read_module(path):
+    f = open(path)
+    text = f.read()
+    f.close()
+    top = read_sexp(tokenize(text))
+    if len(top) != 1 or top[0][0] != "MODULE":
+        raise SimulationError("{} is not a MODULE".format(path))
+    x = top[0]
+    module = ir_ast.Module(x[1])
+    for part in x[2:]:
+        if part[0] == "VARIABLES":
+            for v in part[1:]:
+                module.declare_variable(read_variable(v))
+        elif part[0] == "BOARD":
+            board = ir_ast.Board(module, part[2], part[1])
+            table = {}
+            for v in module.variables:
+                table[v.name] = v
+            for sub in part[3:]:
+                if sub[0] == "VARIABLES":
+                    for v in sub[1:]:
+                        v = read_variable(v)
+                        board.variables.append(v)
+                        table[v.name] = v
+                elif sub[0] == "SEQUENCER":
+                    for s in sub[2:]:
+                        slot = ir_ast.Slot(int(s[1]))
+                        slot.items = [read_item(item, table) for item in s[2:]]
+                        board.slots.append(slot)
+            board.slots.sort(key=lambda s: s.id)
+            module.boards.append(board)
+    return module
+
+def random_vectors(board, count, low, high, seed=None):
+    r = random.Random(seed)
+    n = len(parameters(board))
+    return [[r.randint(low, high) for k in range(n)] for i in range(count)]
+
+def read_vectors(path):
+    # one vector per line, values separated by commas or spaces
+    vectors = []
+    f = open(path)
+    for line in f:
+        line = line.split("#")[0].replace(",", " ").split()
+        if len(line) > 0:
+            vectors.append([int(v, 0) for v in line])
+    f.close()
+    return vectors
+
+def make_option_parser():
+    usage = "Usage: %prog [options] FILE.ir"
+    p = OptionParser(usage)
+    p.add_option("-b", "--board", dest="board", help="board to run (default: the last one)")
+    p.add_option("-a", "--args", dest="args", help="comma separated arguments of a single run")
+    p.add_option("--vectors", dest="vectors", metavar="FILE", help="run every argument vector of FILE, one per line")
+    p.add_option("--random", dest="random", type="int", default=0, metavar="N", help="run N random argument vectors")
+    p.add_option("--range", dest="range", default="0,100", metavar="LOW,HIGH", help="range of the random arguments")
+    p.add_option("--seed", dest="seed", type="int", help="seed of the random arguments")
+    p.add_option("--max-cycles", dest="max_cycles", type="int", default=10**7, help="cycles a call may take before it is stopped")
+    p.add_option("--profile", dest="profile", metavar="FILE", help="write the visits and cycles of every slot to FILE")
+    p.add_option("-v", "--verbose", dest="verbose", action="store_true", default=False, help="print every run of a batch")
+    return p
+
+if __name__ == '__main__':
+    p = make_option_parser()
+    opts, args = p.parse_args()
+    if len(args) != 1:
+        p.print_help()
+        exit(0)
+    module = read_module(args[0])
+    if len(module.boards) == 0:
+        print("no boards in", args[0])
+        exit(-1)
+    name = opts.board
+    if name is None:
+        name = module.boards[-1].name
+    sim = Simulator(module.boards, module.variables, opts.max_cycles)
+    board = sim.board(name)
+    try:
+        if opts.vectors is not None or opts.random > 0:
+            if opts.vectors is not None:
+                vectors = read_vectors(opts.vectors)
+            else:
+                low, high = [int(v) for v in opts.range.split(",")]
+                vectors = random_vectors(board, opts.random, low, high, opts.seed)
+            values, cycles, members = sim.run_batch(name, vectors)
+            if opts.verbose:
+                for v, r, c in zip(vectors, values, cycles):
+                    print("{}({}) = {} in {} cycles".format(name, ", ".join([str(x) for x in v]), r, c))
+            cycles = [int(c) for c in cycles]
+            if len(cycles) > 0:
+                print("{}: {} runs, cycles min {} mean {:.1f} max {}".format(name, len(cycles), min(cycles), sum(cycles) / len(cycles), max(cycles)))
+        else:
+            call_args = []
+            if opts.args is not None:
+                call_args = [int(v, 0) for v in opts.args.split(",")]
+            value, cycles = sim.call(name, call_args)
+            print("{}({}) = {} in {} cycles".format(name, ", ".join([str(x) for x in call_args]), value, cycles))
+    except SimulationError as e:
+        print(e)
+        exit(-1)
+    if opts.profile is not None:
+        write_profile(sim, opts.profile)
@@ -0,0 +1,187 @@
+import contextlib
+import json
+import time
+
+import ir_ast
+import ir_sched
+
+# per-phase compile statistics and a static hardware cost report per board
+
+PHASES = ("parse", "lower", "optimize", "emit")
+
+collector = None
+
+class Collector:
+
+    # with memory, allocations are traced by tracemalloc, which makes the
+    # phases several times slower; the times are then marked as traced
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.started = False # whether tracing was started for this collector
+        self.phases = {}
+        for name in PHASES:
+            self.phases[name] = {"time": 0.0, "allocated": 0, "peak": 0, "count": 0}
+        self.boards = []
+        self.cycles = {} # board name -> estimated cycles, used for calls
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        if not self.memory:
+            t = time.perf_counter()
+            try:
+                yield
+            finally:
+                p = self.phases[name]
+                p["time"] += time.perf_counter() - t
+                p["count"] += 1
+            return
+        import tracemalloc # loaded by enable()
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - t
+            after, peak = tracemalloc.get_traced_memory()
+            p = self.phases[name]
+            p["time"] += elapsed
+            p["allocated"] += max(after - before, 0)
+            p["peak"] = max(p["peak"], peak - before)
+            p["count"] += 1
+
+    def merge(self, phases):
+        for name, q in phases.items():
+            p = self.phases[name]
+            p["time"] += q["time"]
+            p["allocated"] += q["allocated"]
+            p["peak"] = max(p["peak"], q["peak"])
+            p["count"] += q["count"]
+
+    def record_board(self, board):
+        s = board_stats(board, self.cycles)
+        self.cycles[board.name] = s["cycles"]
+        self.boards.append(s)
+
+    def report(self):
+        return {"phases": self.phases, "boards": self.boards, "memory": self.memory}
+
+def enable(memory=False):
+    global collector
+    collector = Collector(memory)
+    if memory:
+        import tracemalloc # only loaded when allocations are traced
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            collector.started = True
+    return collector
+
+def disable():
+    # stops the tracing started by enable, so that a resident process does
+    # not run its next builds traced
+    global collector
+    if collector is not None and collector.started:
+        import tracemalloc
+        tracemalloc.stop()
+    collector = None
+
+def phase(name):
+    if collector is None:
+        return contextlib.nullcontext()
+    return collector.phase(name)
+
+def record_board(board):
+    if collector is not None:
+        collector.record_board(board)
+
+def slot_cycles(slot, calls=None):
+    cycles = 1
+    for item in slot.items:
+        if isinstance(item, ir_ast.CallSlotItem) and item.no_wait:
+            pass
+        elif isinstance(item, (ir_ast.CallSlotItem, ir_ast.JoinSlotItem)) and calls is not None:
+            # a join waits at most as long as the whole call
+            cycles = max(cycles, 1 + calls.get(item.name, 0))
+        else:
+            cycles = max(cycles, ir_sched.LATENCIES.get(ir_sched.item_op(item), 1))
+    return cycles
+
+def longest_path(board, calls=None):
+    # cycles along the longest path from METHOD_ENTRY back to METHOD_EXIT
+    # when every loop is taken at most once (back edges are ignored)
+    if len(board.slots) < 2:
+        return 0
+    order = []
+    state = {1: 1}
+    stack = [(1, iter(board.slots[1].successors()))]
+    while len(stack) > 0:
+        i, succ = stack[-1]
+        n = next(succ, None)
+        if n is None:
+            stack.pop()
+            state[i] = 2
+            order.append(i)
+        elif n != 0 and n < len(board.slots) and n not in state:
+            state[n] = 1
+            stack.append((n, iter(board.slots[n].successors())))
+    # order is a post-order, so the successors of a slot are done before it
+    # except for back edges, which point to slots still on the stack
+    position = {}
+    for k, i in enumerate(order):
+        position[i] = k
+    cost = {}
+    for i in order:
+        best = 0
+        for n in board.slots[i].successors():
+            if n in position and position[n] < position[i]:
+                best = max(best, cost[n])
+        cost[i] = slot_cycles(board.slots[i], calls) + best
+    return cost[1]
+
+def board_stats(board, calls=None):
+    variables = 0
+    temporaries = 0
+    constants = 0
+    for v in board.variables:
+        if isinstance(v, ir_ast.Constant):
+            constants += 1
+        elif v.is_temporary():
+            temporaries += 1
+        else:
+            variables += 1
+    ops = {}
+    items = 0
+    for s in board.slots:
+        for item in s.items:
+            items += 1
+            op = ir_sched.item_op(item)
+            ops[op] = ops.get(op, 0) + 1
+    return {"name": board.name, "slots": len(board.slots), "items": items,
+            "variables": variables, "temporaries": temporaries, "constants": constants,
+            "ops": ops, "cycles": longest_path(board, calls)}
+
+def format_text(report):
+    if report["memory"]:
+        lines = ["{:10} {:>10} {:>8} {:>14} {:>14}".format("phase", "time [s]*", "count", "allocated [B]", "peak [B]")]
+    else:
+        lines = ["{:10} {:>10} {:>8}".format("phase", "time [s]", "count")]
+    for name in PHASES:
+        p = report["phases"][name]
+        if report["memory"]:
+            lines.append("{:10} {:>10.4f} {:>8} {:>14} {:>14}".format(name, p["time"], p["count"], p["allocated"], p["peak"]))
+        else:
+            lines.append("{:10} {:>10.4f} {:>8}".format(name, p["time"], p["count"]))
+    if report["memory"]:
+        lines.append("* measured with tracemalloc on, which slows the phases down")
+    for b in report["boards"]:
+        lines.append("")
+        lines.append("board {}: {} slots, {} items, {} variables, {} temporaries, {} constants, longest path {} cycles".format(
+            b["name"], b["slots"], b["items"], b["variables"], b["temporaries"], b["constants"], b["cycles"]))
+        ops = sorted(b["ops"].items(), key=lambda x: (-x[1], x[0]))
+        lines.append("  " + ", ".join(["{} {}".format(op, n) for op, n in ops]))
+    return "\n".join(lines) + "\n"
+
+def write_json(report, path):
+    f = open(path, "w")
+    json.dump(report, f, indent=1)
+    f.close()
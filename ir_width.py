@@ -0,0 +1,239 @@
+import ir_ast
+import ir_cfg
+import ir_opt
+import ir_pipeline
+
+# range analysis of the integer variables of a board, narrowing the kinds
+# of temporaries and the 64-bit operators to what their values need.
+#
+# The ranges are flow-insensitive: a variable holds the union of the values
+# of all its definitions. A result which does not fit the kind of its
+# variable wraps around, so it gets the whole range of the kind. Uses of the
+# counter of an i < n loop before it is incremented are known to be below n.
+
+# definitions changing the range of a variable more often are widened to
+# the bounds of its kind
+WIDEN_AFTER = 3
+# recomputations after the widening, to win back the bounds of loops
+NARROW_ROUNDS = 2
+
+KINDS = ["BYTE", "SHORT", "INT", "LONG"]
+
+NARROW_OPS = {"MUL64": "MUL32", "DIV64": "DIV32", "MOD64": "MOD32",
+              "SIMPLE_LSHIFT64": "SIMPLE_LSHIFT32", "SIMPLE_ARITH_RSHIFT64": "SIMPLE_ARITH_RSHIFT32"}
+
+def kind_range(kind):
+    w = ir_opt.WIDTHS[kind]
+    return (-(1 << (w - 1)), (1 << (w - 1)) - 1)
+
+def fits(r, kind):
+    lo, hi = kind_range(kind)
+    return lo <= r[0] and r[1] <= hi
+
+def union(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return (min(a[0], b[0]), max(a[1], b[1]))
+
+def bits(r):
+    # n such that r lies in [-2**n, 2**n-1]
+    return max(r[1].bit_length(), (-r[0] - 1).bit_length() if r[0] < 0 else 0)
+
+def is_tracked(v):
+    return (isinstance(v, ir_ast.Variable) and not isinstance(v, ir_ast.ArrayVariable)
+            and v.kind in ir_opt.WIDTHS and not v.member and not v.method_param and not v.volatile)
+
+def binary_range(op, a, b):
+    # the values of op on a and b before wrapping, or None if unknown
+    base = op.rstrip("0123456789")
+    if base == "ADD":
+        return (a[0] + b[0], a[1] + b[1])
+    elif base == "SUB":
+        return (a[0] - b[1], a[1] - b[0])
+    elif base == "MUL":
+        products = [x * y for x in a for y in b]
+        return (min(products), max(products))
+    elif base == "DIV":
+        m = max(-a[0], a[1])
+        if a[0] >= 0 and b[0] >= 0:
+            return (0, m)
+        return (-m, m)
+    elif base == "MOD":
+        # the remainder of a division by zero is the dividend
+        m = max(-a[0], a[1])
+        if b[0] > 0 or b[1] < 0:
+            m = min(m, max(-b[0], b[1]) - 1)
+        if a[0] >= 0:
+            return (0, m)
+        return (-m, m)
+    elif base == "AND":
+        if a[0] >= 0 and b[0] >= 0:
+            return (0, min(a[1], b[1]))
+        elif a[0] >= 0:
+            return (0, a[1])
+        elif b[0] >= 0:
+            return (0, b[1])
+    if base == "AND" or base == "OR" or base == "XOR":
+        n = max(bits(a), bits(b))
+        if a[0] >= 0 and b[0] >= 0:
+            return (0, (1 << n) - 1)
+        return (-(1 << n), (1 << n) - 1)
+    if b[0] != b[1] or b[0] < 0 or b[0] >= 32:
+        return None
+    if base == "SIMPLE_LSHIFT":
+        return (a[0] << b[0], a[1] << b[0])
+    elif base == "SIMPLE_ARITH_RSHIFT":
+        return (a[0] >> b[0], a[1] >> b[0])
+    elif base == "SIMPLE_LOGIC_RSHIFT" and a[0] >= 0:
+        return (a[0] >> b[0], a[1] >> b[0])
+    return None
+
+class Ranges:
+
+    def __init__(self, board):
+        self.board = board
+        self.ranges = {}
+        self.defs = [] # (item, variable) for the definitions of tracked variables
+        for s in board.slots:
+            for item in s.items:
+                for v in item.defs():
+                    if is_tracked(v):
+                        self.defs.append((item, v))
+        # variables which are not temporaries start as zero, as registers do
+        for v in board.variables:
+            if is_tracked(v) and not v.is_temporary():
+                self.ranges[v.name] = (0, 0)
+        self.limits = {} # id of item -> (counter, bound) of the loop around it
+        preds = ir_cfg.predecessors(board)
+        for s in board.slots:
+            for item in s.items:
+                if isinstance(item, ir_ast.JTSlotItem):
+                    self.add_loop(item, preds)
+
+    def add_loop(self, jt, preds):
+        loop, reason = ir_pipeline.find_loop(self.board, jt, preds)
+        if loop is None or not is_tracked(loop["counter"]):
+            return
+        counter = loop["counter"]
+        for item in loop["ops"]:
+            self.limits[id(item)] = (counter.name, loop["bound"])
+            if counter.name in ir_cfg.def_names(item):
+                break
+
+    def value(self, v, item=None):
+        # the range of v read by item, or None while it is not known
+        if isinstance(v, ir_ast.Constant):
+            c = ir_opt.constant_value(v)
+            if c is None:
+                return kind_range("LONG")
+            return (c, c)
+        if v.kind not in ir_opt.WIDTHS:
+            return kind_range("LONG")
+        if not is_tracked(v):
+            return kind_range(v.kind)
+        r = self.ranges.get(v.name)
+        limit = self.limits.get(id(item))
+        if r is not None and limit is not None and limit[0] == v.name:
+            bound = self.value(limit[1])
+            if bound is None:
+                return r
+            if r[0] > bound[1] - 1:
+                return None
+            return (r[0], min(r[1], bound[1] - 1))
+        return r
+
+    def def_range(self, item, v):
+        # the range of v as defined by item, or None while it is not known
+        full = kind_range(v.kind)
+        if isinstance(item, ir_ast.AssignSlotItem):
+            r = self.value(item.rhs, item)
+        elif isinstance(item, ir_ast.CondSlotItem):
+            a = self.value(item.v0, item)
+            b = self.value(item.v1, item)
+            if a is None or b is None:
+                return None
+            r = union(a, b)
+        elif isinstance(item, ir_ast.BinaryOpSlotItem):
+            a = self.value(item.v0, item)
+            b = self.value(item.v1, item)
+            if a is None or b is None:
+                return None
+            r = binary_range(item.binary_op, a, b)
+            if r is None:
+                return full
+        else:
+            return full
+        if r is None:
+            return None
+        if not fits(r, v.kind):
+            return full
+        return r
+
+    def solve(self):
+        changes = {}
+        changed = True
+        while changed:
+            changed = False
+            for item, v in self.defs:
+                r = self.def_range(item, v)
+                old = self.ranges.get(v.name)
+                new = union(old, r)
+                if new == old:
+                    continue
+                changes[v.name] = changes.get(v.name, 0) + 1
+                if old is not None and changes[v.name] > WIDEN_AFTER:
+                    lo, hi = kind_range(v.kind)
+                    new = (lo if new[0] < old[0] else new[0], hi if new[1] > old[1] else new[1])
+                self.ranges[v.name] = new
+                changed = True
+        for n in range(NARROW_ROUNDS):
+            fresh = {}
+            for item, v in self.defs:
+                fresh[v.name] = union(fresh.get(v.name), self.def_range(item, v))
+            for v in self.board.variables:
+                if is_tracked(v) and not v.is_temporary():
+                    fresh[v.name] = union(fresh.get(v.name), (0, 0))
+            for name, r in fresh.items():
+                old = self.ranges.get(name)
+                if r is not None and old is not None:
+                    self.ranges[name] = (max(old[0], r[0]), min(old[1], r[1]))
+        return self.ranges
+
+def narrow(board):
+    # narrows the temporaries and operators of board; returns the number of
+    # temporaries narrowed, the register bits saved and the operators made
+    # 32-bit
+    analysis = Ranges(board)
+    ranges = analysis.solve()
+    temps = 0
+    saved = 0
+    for v in board.variables:
+        if not is_tracked(v) or not v.is_temporary() or ranges.get(v.name) is None:
+            continue
+        for kind in KINDS:
+            if ir_opt.WIDTHS[kind] >= ir_opt.WIDTHS[v.kind]:
+                break
+            if fits(ranges[v.name], kind):
+                saved += ir_opt.WIDTHS[v.kind] - ir_opt.WIDTHS[kind]
+                temps += 1
+                v.kind = kind
+                break
+    ops = 0
+    for s in board.slots:
+        for item in s.items:
+            if not isinstance(item, ir_ast.BinaryOpSlotItem) or item.binary_op not in NARROW_OPS:
+                continue
+            if item.ret.kind not in ir_opt.WIDTHS or ir_opt.WIDTHS[item.ret.kind] > 32:
+                continue
+            a = analysis.value(item.v0, item)
+            b = analysis.value(item.v1, item)
+            if a is None or b is None or not fits(a, "INT") or not fits(b, "INT"):
+                continue
+            r = binary_range(item.binary_op, a, b)
+            if r is None or not fits(r, "INT"):
+                continue
+            item.binary_op = NARROW_OPS[item.binary_op]
+            ops += 1
+    return temps, saved, ops